@@ -0,0 +1,150 @@
+import argparse
+import logging
+import re
+import time
+from src.config import DBContext, staged
+
+logger = logging.getLogger(__name__)
+
+# metric name -> stored as stock_<metric>; N is a number of trading days (rows of price_wide)
+#   log_return       LN(price / previous price)
+#   return_Nd        simple N-day return, in percent
+#   volatility_Nd    sample stddev of daily log returns over the last N days
+#   vwap_Nd          volume-weighted average price over the last N days (uses trade_volume_wide)
+DEFAULT_METRICS = ("log_return", "return_5d", "return_21d", "return_252d", "volatility_21d", "vwap_21d")
+METRIC_PATTERN = re.compile(r"^(log_return|return_(\d+)d|volatility_(\d+)d|vwap_(\d+)d)$")
+
+
+def parse_metric(metric: str) -> tuple[str, int]:
+    """(kind, days) of a metric name, e.g. volatility_21d -> (volatility, 21)"""
+    match = METRIC_PATTERN.match(metric)
+    if not match:
+        raise ValueError(f"Unknown metric {metric!r}, expected log_return, return_Nd, volatility_Nd or vwap_Nd")
+    if metric == "log_return":
+        return "log_return", 1
+    kind = metric.rsplit("_", 1)[0]
+    days = int(next(group for group in match.groups()[1:] if group))
+    if days < 1:
+        raise ValueError(f"{metric}: horizon must be at least 1 day")
+    return kind, days
+
+def metric_table(metric: str) -> str:
+    return f"stock_{metric}"
+
+def metric_expr(metric: str, stock: str) -> str:
+    """Outer-query expression of one metric for one column, over the inner query's columns"""
+    kind, days = parse_metric(metric)
+    frame = f"(ORDER BY date ROWS BETWEEN {days - 1} PRECEDING AND CURRENT ROW)"
+    if kind == "log_return":
+        expr = f"lr_{stock}"
+    elif kind == "return":
+        expr = f"(p_{stock} / NULLIF(LAG(p_{stock}, {days}) OVER w, 0) - 1) * 100"
+    elif kind == "volatility":
+        # the first row has no log return, so N of them are available from row N + 1
+        expr = f"CASE WHEN rn > {days} THEN STDDEV_SAMP(lr_{stock}) OVER {frame} END"
+    else:
+        expr = (f"CASE WHEN rn >= {days} THEN SUM(p_{stock}::DOUBLE * v_{stock}) OVER {frame}"
+                f" / NULLIF(SUM(v_{stock}) OVER {frame}, 0) END")
+    return f"({expr})::FLOAT AS {metric}__{stock}"
+
+def analytics_sql(con: DBContext, metrics: list[str], stock_columns: list[str]) -> str:
+    """
+    SELECT computing every metric for stock_columns in one ordered pass over
+    price_wide (joined to trade_volume_wide only when a vwap metric is asked for).
+    The inner query reads each column and its log return once; the outer query
+    derives every horizon and rolling statistic from them.
+    """
+    use_volume = any(parse_metric(metric)[0] == "vwap" for metric in metrics)
+    inner = ["p.date", "ROW_NUMBER() OVER w AS rn"]
+    for stock in stock_columns:
+        inner.append(f"p.{stock} AS p_{stock}")
+        inner.append(f"LN(NULLIF(p.{stock}, 0) / NULLIF(LAG(p.{stock}, 1) OVER w, 0)) AS lr_{stock}")
+        if use_volume:
+            inner.append(f"v.{stock} AS v_{stock}")
+    source = "price_wide p JOIN trade_volume_wide v ON p.date = v.date" if use_volume else "price_wide p"
+    outer = ", ".join(metric_expr(metric, stock) for metric in metrics for stock in stock_columns)
+    return f"""
+        SELECT date, {outer}
+        FROM (
+            SELECT {', '.join(inner)}
+            FROM {source}
+            WINDOW w AS (ORDER BY p.date)
+        )
+        WINDOW w AS (ORDER BY date)
+        ORDER BY date
+    """
+
+@staged("analytics")
+def main(con: DBContext, metrics: list[str] = DEFAULT_METRICS, group_size: int = None) -> dict:
+    """
+    Compute the chosen metrics and store each as a wide (date x stk_<id>) table
+    named stock_<metric>, next to stock_returns.
+
+    Args:
+        con: DBContext
+        metrics: metric names, see DEFAULT_METRICS
+        group_size: columns per pass; each pass computes every metric for its
+            columns into a temp table. Defaults to all columns in one pass.
+    """
+    for metric in metrics:
+        parse_metric(metric)
+    stock_columns = con.STOCK_COLUMNS
+    group_size = group_size or len(stock_columns)
+    groups = [stock_columns[i:i + group_size] for i in range(0, len(stock_columns), group_size)]
+
+    timings = {}
+    start = time.perf_counter()
+    for i, group in enumerate(groups):
+        sql = analytics_sql(con, metrics, group)
+        logger.info(sql)
+        con.execute(f"CREATE OR REPLACE TEMP TABLE analytics_group_{i} AS {sql}")
+        logger.info(f"Computed {len(metrics)} metrics for {group[0]}-{group[-1]}")
+    timings["passes"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    joins = " ".join(f"JOIN analytics_group_{i} USING (date)" for i in range(1, len(groups)))
+    try:
+        con.execute("BEGIN TRANSACTION")
+        for metric in metrics:
+            columns = ", ".join(f"{metric}__{stock} AS {stock}" for stock in stock_columns)
+            con.execute(f"""
+                CREATE OR REPLACE TABLE {metric_table(metric)} AS
+                SELECT date, {columns}
+                FROM analytics_group_0 {joins}
+                ORDER BY date
+            """)
+            logger.info(f"Stored {metric_table(metric)}")
+        con.execute("COMMIT")
+    except Exception as e:
+        logger.error(f"Error storing analytics tables: {e}")
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        for i in range(len(groups)):
+            con.execute(f"DROP TABLE IF EXISTS analytics_group_{i}")
+    timings["store"] = time.perf_counter() - start
+
+    logger.info(f"analytics: {len(metrics)} metrics x {len(stock_columns)} columns in {len(groups)} passes "
+                f"({timings['passes']:.2f}s), stored in {timings['store']:.2f}s")
+    return timings
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("logs/analytics.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+    parser = argparse.ArgumentParser(description='Compute multi-horizon returns and rolling statistics')
+    parser.add_argument('--metrics', nargs='+', default=list(DEFAULT_METRICS),
+                        help='log_return, return_Nd, volatility_Nd and/or vwap_Nd (N trading days)')
+    parser.add_argument('--group-size', type=int, default=None,
+                        help='columns per ordered pass (default: all columns in one pass)')
+    args = parser.parse_args()
+
+    with DBContext(profile=True, metrics_path="logs/metrics.jsonl", metrics_table="pipeline_metrics") as con:
+        main(con, metrics=args.metrics, group_size=args.group_size)
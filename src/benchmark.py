@@ -0,0 +1,161 @@
+import argparse
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+
+from src import generate, ingest, returns, transform
+from src.config import DBContext, PeakRSS
+from src.verify import verify_all
+
+logger = logging.getLogger(__name__)
+
+# dataset size in GB of CSV, as generate.py counts it
+SCALES = {"10mb": 0.01, "1gb": 1.0, "10gb": 10.0}
+GENERATE_START, GENERATE_END = "1970-01-01", "2025-12-31"
+BYTES_PER_ROW = 25  # generate.py's estimate for one CSV row
+# dates generate.py produces for that range (business days)
+BUSINESS_DAYS = len(pd.bdate_range(GENERATE_START, GENERATE_END))
+
+
+def dataset_shape(size_gb: float) -> int:
+    """Stocks needed so a dataset of size_gb fits the generator's date range"""
+    rows = size_gb * 1024 ** 3 / BYTES_PER_ROW
+    return max(200, math.ceil(rows / BUSINESS_DAYS))
+
+def generate_dataset(output_dir: Path, size_gb: float, *, seed: int = 42, num_files: int = 2,
+                     file_format: str = "csv", workers: int = 1) -> dict:
+    num_stocks = dataset_shape(size_gb)
+    start = time.perf_counter()
+    generate.generate_stock_data_files(
+        num_files=num_files, file_size_gb=size_gb / num_files, num_stocks=num_stocks,
+        start_date=GENERATE_START, end_date=GENERATE_END, output_dir=str(output_dir),
+        engine="vectorized", seed=seed, workers=workers, file_format=file_format,
+    )
+    files = [path for pattern in ingest.INPUT_PATTERNS for path in output_dir.glob(pattern)]
+    return {
+        "size_gb": size_gb, "num_stocks": num_stocks, "seed": seed, "format": file_format,
+        "files": len(files), "bytes": sum(path.stat().st_size for path in files),
+        "generate_seconds": time.perf_counter() - start,
+    }
+
+def timed(stage: str, engine: str, step) -> dict:
+    with PeakRSS() as peak:
+        start = time.perf_counter()
+        step()
+        seconds = time.perf_counter() - start
+    logger.info(f"{stage} ({engine}): {seconds:.2f}s, peak RSS {peak.peak_mb:.0f} MB")
+    return {"stage": stage, "engine": engine, "seconds": seconds, "peak_rss_mb": peak.peak_mb}
+
+def run_config(input_dir: Path, db_dir: Path, *, cpu_count: int, memory_limit: float, batch_size: int,
+               transform_engines=("batched", "pivot"), returns_engines=("batched", "window")) -> list[dict]:
+    """
+    Time every stage and engine once on a fresh database: ingest, both wide
+    tables per transform engine, returns per engine, then verify. Only the
+    batched engines use batch_size; other results record it as None.
+    """
+    db_dir.mkdir(parents=True, exist_ok=True)
+    results = []
+    with DBContext(db_path=str(db_dir / "stocks.duckdb"), cpu_count=cpu_count, memory_limit=memory_limit) as con:
+        results.append(timed("ingest", "bulk", lambda: ingest.process_file_by_file(
+            con, input_dir=str(input_dir), mode="bulk", close=False)))
+        for engine in transform_engines:
+            results.append(timed("transform", engine, lambda: transform.main(
+                con, field="all", engine=engine, batch_size=batch_size)))
+        for engine in returns_engines:
+            def step():
+                if engine == "batched":
+                    returns.create_table(con)
+                returns.calculate_returns(con, engine=engine, batch_size=batch_size)
+            results.append(timed("returns", engine, step))
+        results.append(timed("verify", "scan", lambda: verify_all(con)))
+    shutil.rmtree(db_dir)
+    for result in results:
+        result.update(cpu_count=cpu_count, memory_limit=memory_limit,
+                      batch_size=batch_size if result["engine"] == "batched" else None)
+    return results
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "duckdb": duckdb.__version__,
+        "machine": platform.machine(),
+        "processor_count": os.cpu_count(),
+    }
+
+def main(scales: list[str] = ("10mb",), *, cpu_counts=(4,), memory_limits=(1,), batch_sizes=(20,), seed: int = 42,
+         file_format: str = "csv", output: str = "logs/benchmark.json", work_dir: str = None) -> dict:
+    """
+    Generate a seeded dataset per scale in a temporary directory and time
+    every stage and engine for each cpu_count x memory_limit x batch_size
+    combination. The pivot and window engines ignore batch_size, so they run
+    once per cpu_count x memory_limit pair, with its first batch size.
+    Results are written to `output` as JSON, one record per stage run, so
+    runs can be compared commit to commit.
+    """
+    report = {"environment": environment(), "datasets": {}, "results": []}
+    root = Path(tempfile.mkdtemp(prefix="etl-benchmark-", dir=work_dir))
+    try:
+        for scale in scales:
+            input_dir = root / scale / "input"
+            report["datasets"][scale] = generate_dataset(input_dir, SCALES.get(scale) or float(scale),
+                                                         seed=seed, file_format=file_format)
+            for i, (cpu_count, memory_limit, batch_size) in enumerate(
+                    itertools.product(cpu_counts, memory_limits, batch_sizes)):
+                logger.info(f"{scale}: cpu_count={cpu_count}, memory_limit={memory_limit}GB, batch_size={batch_size}")
+                engines = {} if batch_size == batch_sizes[0] else {
+                    "transform_engines": ("batched",), "returns_engines": ("batched",)}
+                for result in run_config(input_dir, root / scale / f"run_{i}", cpu_count=cpu_count,
+                                         memory_limit=memory_limit, batch_size=batch_size, **engines):
+                    report["results"].append({"scale": scale, **result})
+            shutil.rmtree(input_dir)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    Path(output).write_text(json.dumps(report, indent=2))
+    logger.info(f"Wrote {len(report['results'])} results to {output}")
+    return report
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("logs/benchmark.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+    parser = argparse.ArgumentParser(description='Time every ETL stage and engine on seeded datasets')
+    parser.add_argument('--scales', nargs='+', default=['10mb'],
+                        help=f'dataset sizes: {", ".join(SCALES)} or a size in GB')
+    parser.add_argument('--cpu-count', type=int, nargs='+', default=[4], help='DuckDB threads to try')
+    parser.add_argument('--memory-limit', type=float, nargs='+', default=[1], help='DuckDB memory limits (GB) to try')
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[20], help='batch sizes of the batched engines')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--format', choices=['csv', 'parquet', 'arrow'], default='csv', help='generated file format')
+    parser.add_argument('--output', default='logs/benchmark.json', help='results file')
+    parser.add_argument('--work-dir', default=None, help='where to create the temporary datasets')
+    args = parser.parse_args()
+
+    main(args.scales, cpu_counts=args.cpu_count, memory_limits=args.memory_limit, batch_sizes=args.batch_size,
+         seed=args.seed, file_format=args.format, output=args.output, work_dir=args.work_dir)
@@ -1,29 +1,134 @@
+import functools
+import json
 import logging
 import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Set 
 
 import duckdb
 import psutil
+import pyarrow as pa
 
 logger = logging.getLogger(__name__)
 
+# statements whose result is a count of rows written
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE', 'CREATE', 'COPY')
+# DBContext.execute result formats: Python tuples, Arrow table, dict of NumPy arrays, Arrow RecordBatchReader
+FETCH_MODES = ("all", "arrow", "numpy", "reader")
+PROFILED_PREFIXES = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'CREATE', 'COPY')
+
+# one row per statement run through DBContext.execute
+METRICS_COLUMNS = """
+        (run_id VARCHAR,
+        stage VARCHAR,
+        statement VARCHAR,
+        started_at TIMESTAMP,
+        wall_seconds DOUBLE,
+        cpu_seconds DOUBLE,
+        rows BIGINT,
+        spilled_bytes BIGINT,
+        peak_rss_mb DOUBLE,
+        rss_change_mb DOUBLE
+        )
+"""
+
+def stock_columns(con: duckdb.DuckDBPyConnection, table: str) -> list[str]:
+    """stk_<id> columns of a wide table, in table order"""
+    return [row[0] for row in con.execute(f"""
+        SELECT column_name FROM duckdb_columns()
+        WHERE table_name = '{table}' AND starts_with(column_name, 'stk_')
+        ORDER BY column_index
+    """).fetchall()]
+
+def wide_query(con: duckdb.DuckDBPyConnection, table: str, *, start=None, end=None, symbols: list[int] = None) -> str:
+    """SELECT of a date range and symbol subset of a wide table; raises ValueError for unknown columns"""
+    available = stock_columns(con, table)
+    if not available:
+        raise ValueError(f"{table} is not a wide table")
+    columns = available if symbols is None else [f"stk_{id}" for id in symbols]
+    missing = sorted(set(columns) - set(available))
+    if missing:
+        raise ValueError(f"{table} has no columns {missing}")
+
+    filters = []
+    if start is not None:
+        filters.append(f"date >= '{start}'")
+    if end is not None:
+        filters.append(f"date <= '{end}'")
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    return f"SELECT date, {', '.join(columns)} FROM {table} {where} ORDER BY date"
+
 class DBContext:
     
-    SYMBOLS = list(range(1, 201)) # known
-    STOCK_COLUMNS = [f"stk_{id}" for id in SYMBOLS]
+    DEFAULT_SYMBOLS = list(range(1, 201)) # used until an ingest has recorded stocks.symbols
 
-    def __init__(self, db_path: str = './data/stocks.duckdb', cpu_count: int = 4, memory_limit: int = 24, profile: bool = False, **kwargs):
+    def __init__(self, db_path: str = './data/stocks.duckdb', cpu_count: int = 4, memory_limit: int = 24, profile: bool = False,
+                 metrics_path: str = None, metrics_table: str = None, **kwargs):
+        """
+        Args:
+            metrics_path: append one JSON line per executed statement (see METRICS_COLUMNS)
+            metrics_table: also store those records in this table when the connection closes
+        """
         self.con = duckdb.connect(db_path)
         self.memory_limit = memory_limit
         self.cpu_count = cpu_count
         self.profile = profile
         self.process = psutil.Process(os.getpid())
+        self._symbols = None
+        self.run_id = uuid.uuid4().hex[:12]
+        self.current_stage = None
+        self.metrics: list[dict] = []
+        self.metrics_path = metrics_path
+        self.metrics_table = metrics_table
+        self._metrics_flushed = 0
+        self.last_profile = None
+        self.configure()
+        self.temp_dir = Path(self.con.execute("SELECT current_setting('temp_directory')").fetchone()[0])
          
 
     def __enter__(self):
         return self
 
+    @property
+    def SYMBOLS(self) -> list[int]:
+        """Stock ids discovered at ingest (stocks.symbols), loaded once per connection"""
+        if self._symbols is None:
+            self._symbols = self.load_symbols()
+        return self._symbols
+
+    @property
+    def STOCK_COLUMNS(self) -> list[str]:
+        return [f"stk_{id}" for id in self.SYMBOLS]
+
+    def load_symbols(self) -> list[int]:
+        """
+        Ids in stocks.symbols. Databases ingested before the table existed fall
+        back to the distinct ids of stocks.raw, and empty ones to DEFAULT_SYMBOLS.
+        """
+        tables = {row[0] for row in self.con.execute("""
+            SELECT table_name FROM duckdb_tables()
+            WHERE database_name = 'stocks' AND table_name IN ('symbols', 'raw')
+        """).fetchall()}
+        if "symbols" in tables:
+            return [row[0] for row in self.con.execute("SELECT id FROM stocks.symbols ORDER BY id").fetchall()]
+        if "raw" in tables:
+            logger.warning("stocks.symbols not found, discovering symbols from stocks.raw")
+            return [row[0] for row in self.con.execute("SELECT DISTINCT id FROM stocks.raw ORDER BY id").fetchall()]
+        return list(self.DEFAULT_SYMBOLS)
+
+    def batch_target_mb(self, fraction: float = 0.25) -> float:
+        """Memory budget for one adaptive batch: a fraction of memory_limit"""
+        return self.memory_limit * 1024 * fraction
+
+    def reset_symbols(self):
+        """Reload the symbol set on next use, e.g. after an ingest rewrote stocks.symbols"""
+        self._symbols = None
+
     def configure(self, libraries: list[str] = None):
         if libraries:
             for lib in libraries:
@@ -32,48 +137,187 @@ class DBContext:
         self.con.execute(f"PRAGMA threads={self.cpu_count}")
 
         if self.profile:
-            stmt = f"""
+            # profile every statement as it runs; the JSON tree is read back after each one
+            stmt = """
+            PRAGMA enable_profiling='no_output';
             PRAGMA profiling_mode='detailed';
-            PRAGMA custom_profiling_settings = '{"CPU_TIME": "true", "EXTRA_INFO": "true", "OPERATOR_CARDINALITY": "true", "OPERATOR_TIMING": "true"}'; 
-            PRAGMA enable_object_cache=false;
+            PRAGMA custom_profiling_settings = '{"CPU_TIME": "true", "EXTRA_INFO": "true", "OPERATOR_CARDINALITY": "true", "OPERATOR_TIMING": "true", "OPERATOR_ROWS_SCANNED": "true", "LATENCY": "true", "SYSTEM_PEAK_TEMP_DIR_SIZE": "true"}'; 
             """ 
             self.con.execute(stmt)
 
-    def format_profile_output(self, explain_output: list[Any]):
-        plan_lines = []
-        for row in explain_output:
-            if isinstance(row, (tuple, list)) and len(row) > 0:
-                for item in row:
-                    if item is not None:
-                        if isinstance(item, str) and '\n' in item:
-                            plan_lines.extend(item.split('\n'))
-                        else:
-                            plan_lines.append(str(item))
-        return plan_lines
-        
-    def execute(self, query):
-        process = psutil.Process()
-        mem_before = process.memory_info().rss / 1024 / 1024  # MB
-        
-        if self.profile and query.strip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'CREATE', 'COPY')):
-            explain_query = f"EXPLAIN ANALYZE {query}"
-            results = self.con.execute(explain_query).fetchall()
-            plan_lines = self.format_profile_output(results) 
-            plan_text = "\n".join(line for line in plan_lines if line.strip())
-            logger.info(f"Query execution plan for: {query[:100]}...\n{plan_text}")
-            logger.info(f"analyzed_plan\n{plan_text}")
+    def format_profile(self, node: dict, depth: int = 0) -> list[str]:
+        """One line per operator of a JSON profile: type, rows out, time, rows scanned"""
+        lines = []
+        if node.get("operator_type"):
+            scanned = f", {node['operator_rows_scanned']:,} scanned" if node.get("operator_rows_scanned") else ""
+            lines.append(f"{'  ' * depth}{node['operator_type']}: {node.get('operator_cardinality', 0):,} rows, "
+                         f"{node.get('operator_timing', 0):.4f}s{scanned}")
+            depth += 1
         else:
-            results = self.con.execute(query).fetchall()
-             
-        mem_after = process.memory_info().rss / 1024 / 1024  # MB
+            lines.append(f"latency {node.get('latency', 0):.4f}s, cpu {node.get('cpu_time', 0):.4f}s")
+        for child in node.get("children", []):
+            lines.extend(self.format_profile(child, depth))
+        return lines
+        
+    def rows_scanned(self, table: str = None) -> int:
+        """
+        Rows read by table scans in the last statement run through execute,
+        optionally only scans of `table`. Row groups skipped through zone maps
+        are not counted. Needs profile=True (and duckdb>=1.5.0 for the profile).
+        """
+        if self.last_profile is None:
+            raise RuntimeError("rows_scanned needs a statement run through execute with profile=True")
+        def scanned(node: dict) -> int:
+            rows = 0
+            if node.get("operator_type") == "TABLE_SCAN":
+                scan_table = node.get("extra_info", {}).get("Table", "")
+                if table is None or scan_table.split(".")[-1] == table.split(".")[-1]:
+                    rows = node.get("operator_rows_scanned", 0)
+            return rows + sum(scanned(child) for child in node.get("children", []))
+        return scanned(self.last_profile)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Tag the metrics of every statement run inside the block with a pipeline stage"""
+        previous, self.current_stage = self.current_stage, name
+        try:
+            yield self
+        finally:
+            self.current_stage = previous
+
+    def execute(self, query, fetch: str = "all", rows_per_batch: int = 1_000_000):
+        """
+        Run one statement and return its result in the `fetch` format:
+            all: list of tuples
+            arrow: pyarrow.Table, built without Python objects per value
+            numpy: dict of column name -> NumPy (masked) array
+            reader: pyarrow.RecordBatchReader streaming rows_per_batch rows at a
+                time; the statement runs on its own cursor so the reader stays
+                valid while other statements run, and metrics cover only its start
+        """
+        if fetch not in FETCH_MODES:
+            raise ValueError(f"Unknown fetch mode {fetch!r}, expected one of {FETCH_MODES}")
+        mem_before = self.process.memory_info().rss / 1024 / 1024  # MB
+        cpu_before = self.process.cpu_times()
+        started_at = datetime.now(timezone.utc)
+        start = time.perf_counter()
+
+        with PeakRSS(temp_dir=self.temp_dir) as peak:
+            if fetch == "reader":
+                results = self.record_batch_reader(self.con.cursor().execute(query), rows_per_batch)
+            else:
+                results = self.fetch(self.con.execute(query), fetch)
+        wall_seconds = time.perf_counter() - start
+        cpu_after = self.process.cpu_times()
+
+        spilled_bytes = peak.peak_spill_bytes
+        self.last_profile = None
+        if self.profile and fetch != "reader" and query.strip().upper().startswith(PROFILED_PREFIXES):
+            self.last_profile = json.loads(self.con.get_profiling_information(format="json"))
+            spilled_bytes = max(spilled_bytes, self.last_profile.get("system_peak_temp_dir_size", 0))
+            plan_text = "\n".join(self.format_profile(self.last_profile))
+            logger.info(f"Query profile for: {query[:100]}...\n{plan_text}")
+
+        mem_after = self.process.memory_info().rss / 1024 / 1024  # MB
         mem_change = mem_after - mem_before
         logger.info(f"Memory change: {mem_change:.2f} MB ({mem_before:.2f} MB → {mem_after:.2f} MB)")
+        self.record_metrics({
+            "run_id": self.run_id,
+            "stage": self.current_stage,
+            "statement": " ".join(query.split())[:200],
+            "started_at": started_at.isoformat(),
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": (cpu_after.user - cpu_before.user) + (cpu_after.system - cpu_before.system),
+            "rows": self.rows_produced(query, results),
+            "spilled_bytes": spilled_bytes,
+            "peak_rss_mb": peak.peak_mb,
+            "rss_change_mb": mem_change,
+        })
         return results
+
+    @staticmethod
+    def fetch(result: duckdb.DuckDBPyConnection, fetch: str):
+        if fetch == "arrow":
+            # to_arrow_table replaces fetch_arrow_table in newer DuckDB releases
+            if hasattr(result, "to_arrow_table"):
+                return result.to_arrow_table()
+            return result.fetch_arrow_table()
+        if fetch == "numpy":
+            return result.fetchnumpy()
+        return result.fetchall()
+
+    @staticmethod
+    def record_batch_reader(result: duckdb.DuckDBPyConnection, rows_per_batch: int) -> pa.RecordBatchReader:
+        if hasattr(result, "to_arrow_reader"):
+            return result.to_arrow_reader(rows_per_batch)
+        return result.fetch_record_batch(rows_per_batch)
+
+    def rows_produced(self, query: str, results) -> int:
+        """
+        Rows returned by a query, or rows written by INSERT / UPDATE / DELETE /
+        CREATE TABLE AS / COPY. None for a streaming reader, which has not run yet.
+        """
+        if isinstance(results, pa.RecordBatchReader):
+            return None
+        if isinstance(results, pa.Table):
+            return results.num_rows
+        if isinstance(results, dict):
+            return len(next(iter(results.values()), []))
+        if query.strip().upper().startswith(WRITE_PREFIXES) and len(results) == 1:
+            return results[0][0]
+        return len(results)
+
+    def record_metrics(self, record: dict):
+        self.metrics.append(record)
+        if self.metrics_path:
+            with open(self.metrics_path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+
+    def flush_metrics(self):
+        """Insert records not yet stored into metrics_table"""
+        pending = self.metrics[self._metrics_flushed:]
+        if not self.metrics_table or not pending:
+            return
+        self.con.execute(f"CREATE TABLE IF NOT EXISTS {self.metrics_table} {METRICS_COLUMNS}")
+        self.con.executemany(
+            f"INSERT INTO {self.metrics_table} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [list(record.values()) for record in pending],
+        )
+        self._metrics_flushed = len(self.metrics)
+        logger.info(f"Stored {len(pending)} statement metrics in {self.metrics_table}")
     
 
+    def read_wide(self, table: str, *, start=None, end=None, symbols: list[int] = None, fetch: str = "arrow",
+                  rows_per_batch: int = 1_000_000):
+        """
+        Read a wide (date x stk_<id>) table such as price_wide or stock_returns,
+        ordered by date.
+
+        Args:
+            table: wide table name
+            start, end: inclusive date bounds (date or 'YYYY-MM-DD'), None for open
+            symbols: ids to read, default every stk_ column of the table
+            fetch: "arrow", "numpy" or "reader" (see execute); "reader" bounds
+                memory to rows_per_batch dates at a time
+        """
+        return self.execute(wide_query(self.con, table, start=start, end=end, symbols=symbols),
+                            fetch=fetch, rows_per_batch=rows_per_batch)
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        """A new connection to the same database, for statements run from other threads"""
+        return self.con.cursor()
+
+    def register(self, name: str, obj: Any):
+        """Expose a Python object (Arrow table, DataFrame) to SQL as a view"""
+        self.con.register(name, obj)
+
+    def unregister(self, name: str):
+        self.con.unregister(name)
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         if hasattr(self, 'con') and self.con:
             try:
+                self.flush_metrics()
                 self.con.close()
                 logger.info("Database connection closed successfully")
             except Exception as e:
@@ -83,29 +327,166 @@ class DBContext:
     def close(self):
         """Explicitly close the connection if not using with statement"""
         if hasattr(self, 'con') and self.con:
+            self.flush_metrics()
             self.con.close()
             logger.info("Database connection closed successfully") 
 
-    def verify(self, table: str):
-        stock_columns = self.STOCK_COLUMNS
-        verification_query = f"""
-        SELECT 
-            COUNT(*) as total_rows,
-            {', '.join(f'SUM(CASE WHEN {stock} IS NULL THEN 1 ELSE 0 END) as {stock}_null_count' for stock in stock_columns)}
-        FROM {table} 
-        WHERE date > (SELECT MIN(date) FROM price_wide)
+    def verify(self, table: str, start=None, end=None) -> dict:
+        """Check a wide table in one scan, against stocks.raw (see src.verify)"""
+        from src.verify import verify_all
+        return verify_all(self, (table,), start=start, end=end)[table]
+
+def drop_other_kind(con: DBContext, name: str, kind: str = "TABLE"):
+    """
+    Drop the view (kind="TABLE") or table (kind="VIEW") called name, if any,
+    before creating a `kind` of that name: CREATE OR REPLACE cannot turn a
+    view into a table or back (e.g. a wide table exposed as a view by src.long).
+    """
+    other = "VIEW" if kind == "TABLE" else "TABLE"
+    exists = con.con.execute(f"""
+        SELECT COUNT(*) FROM duckdb_{other.lower()}s() WHERE {other.lower()}_name = '{name}' AND NOT internal
+    """).fetchone()[0]
+    if exists:
+        con.execute(f"DROP {other} {name}")
+
+class PeakRSS:
+    """
+    Sample this process's RSS on a background thread while the block runs;
+    peak_mb holds the highest reading (DuckDB allocations included) and
+    growth_mb how far it rose above the RSS at the start of the block.
+    With temp_dir, peak_spill_bytes holds the largest size of the files in it.
+    """
+    def __init__(self, interval: float = 0.01, temp_dir: Path = None):
+        self.interval = interval
+        self.temp_dir = temp_dir
+        self.process = psutil.Process(os.getpid())
+        self.start_mb = 0.0
+        self.peak_mb = 0.0
+        self.peak_spill_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def spill_bytes(self) -> int:
+        try:
+            return sum(entry.stat().st_size for entry in os.scandir(self.temp_dir) if entry.is_file())
+        except FileNotFoundError:
+            return 0
+
+    def _sample(self):
+        while True:
+            self.peak_mb = max(self.peak_mb, self.process.memory_info().rss / 1024 / 1024)
+            if self.temp_dir is not None:
+                self.peak_spill_bytes = max(self.peak_spill_bytes, self.spill_bytes())
+            if self._stop.wait(self.interval):
+                break
+
+    @property
+    def growth_mb(self) -> float:
+        return self.peak_mb - self.start_mb
+
+    def __enter__(self):
+        self.start_mb = self.process.memory_info().rss / 1024 / 1024
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, self.process.memory_info().rss / 1024 / 1024)
+        return False
+
+def timed_growth(step) -> tuple[float, float]:
+    """
+    Seconds and RSS growth (MB) of step(). Growth is taken over the RSS when
+    step starts, so runs compared back to back are not charged for the buffer
+    pool an earlier one left behind.
+    """
+    with PeakRSS() as peak:
+        start = time.perf_counter()
+        step()
+        seconds = time.perf_counter() - start
+    return seconds, peak.growth_mb
+
+def staged(name: str):
+    """Run a function taking a DBContext first inside con.stage(name)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(con, *args, **kwargs):
+            if not isinstance(con, DBContext):
+                return func(con, *args, **kwargs)
+            with con.stage(name):
+                return func(con, *args, **kwargs)
+        return wrapper
+    return decorator
+
+class AdaptiveBatcher:
+    """
+    Split items into consecutive batches. With target_mb, each batch's size
+    follows the memory the previous batches actually used: track() samples
+    peak RSS while a batch runs, and the next batch is sized so its peak
+    stays within target_mb of the RSS before the first batch. When the
+    caller reports rows, the cost is estimated per row and scaled by the
+    latest batch's rows per item. Without target_mb every batch has
+    initial_size items.
+    """
+    def __init__(self, items: list, *, initial_size: int = 20, target_mb: float = None,
+                 min_size: int = 1, max_size: int = None, max_growth: float = 4.0):
+        self.items = items
+        self.size = max(initial_size, min_size)
+        self.target_mb = target_mb
+        self.min_size = min_size
+        self.max_size = max_size or len(items)
+        self.max_growth = max_growth
+        self.base_mb = None
+        self.mb_per_row = 0.0
+        self.history: list[dict] = []
+
+    def __iter__(self):
+        i = 0
+        while i < len(self.items):
+            batch = self.items[i:i + self.size]
+            yield batch
+            i += len(batch)
+
+    @contextmanager
+    def track(self, batch: list):
         """
-        result = self.con.execute(verification_query).fetchone()
-        total_rows = result[0]
-        logger.info(f"Verification: Table has {total_rows} rows")
-        for i, stock in enumerate(stock_columns):
-            null_count = result[i+1]
-            if null_count == total_rows:
-                logger.error(f"Column {stock} has all NULL values in the table")
-            elif null_count > 0:
-                logger.warning(f"Column {stock} has {null_count} NULL values out of {total_rows} in the table")
-        
-        logger.info("All returns calculated successfully")
+        Measure one batch; the caller may set stats["rows"]. On exit the
+        batch is logged and the size of the next one is chosen.
+        """
+        stats = {"first": batch[0], "last": batch[-1], "size": len(batch), "rows": None}
+        with PeakRSS() as peak:
+            if self.base_mb is None:
+                self.base_mb = peak.start_mb
+            yield stats
+        stats["peak_mb"] = peak.peak_mb
+        stats["growth_mb"] = peak.growth_mb
+        self.history.append(stats)
+        self.resize(stats)
+        rows = f", {stats['rows']:,} rows" if stats["rows"] is not None else ""
+        logger.info(
+            f"Batch {stats['first']}-{stats['last']}: {stats['size']} items{rows}, "
+            f"peak RSS {stats['peak_mb']:.0f} MB (+{stats['growth_mb']:.0f} MB); next batch {self.size} items"
+        )
+
+    def resize(self, stats: dict):
+        if self.target_mb is None:
+            return
+        # memory reused from earlier batches does not show up as growth, so
+        # the batch is charged its whole peak above the RSS before batching;
+        # a floor of 1 MB keeps a batch that freed memory from looking free
+        used_mb = max(stats["peak_mb"] - self.base_mb, 1.0)
+        if stats["rows"]:
+            self.mb_per_row = max(self.mb_per_row, used_mb / stats["rows"])
+            mb_per_item = self.mb_per_row * stats["rows"] / stats["size"]
+        else:
+            mb_per_item = used_mb / stats["size"]
+        size = int(self.target_mb / mb_per_item)
+        self.size = max(self.min_size, min(size, int(stats["size"] * self.max_growth), self.max_size))
+
+    @property
+    def peak_mb(self) -> float:
+        return max((stats["peak_mb"] for stats in self.history), default=0.0)
 
 class ModuleFileHandlerFilter(logging.Filter):
     """
@@ -0,0 +1,192 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import date, datetime, timezone
+from pathlib import Path
+from src.config import DBContext, staged
+
+logger = logging.getLogger(__name__)
+
+EXPORT_TABLES = ("stocks.raw", "price_wide", "trade_volume_wide", "stock_returns")
+# partition key of each row, from its date
+PARTITIONS = {
+    "year": "strftime(date, '%Y')",
+    "month": "strftime(date, '%Y-%m')",
+}
+MANIFEST = "manifest.json"
+
+
+def table_dir(table: str) -> str:
+    return table.split(".")[-1]
+
+def load_manifest(export_dir: str) -> dict:
+    path = Path(export_dir) / MANIFEST
+    return json.loads(path.read_text()) if path.exists() else {"tables": {}}
+
+def write_manifest(export_dir: str, manifest: dict):
+    # written next to the partitions and renamed, so readers never see half a manifest
+    path = Path(export_dir) / MANIFEST
+    tmp_path = path.with_suffix(".json.tmp")
+    tmp_path.write_text(json.dumps(manifest, indent=2, default=str))
+    os.replace(tmp_path, path)
+
+def partition_stats(con: DBContext, table: str, granularity: str) -> dict[str, dict]:
+    """Rows, date range and a content checksum per partition of table, from one scan"""
+    rows = con.con.execute(f"""
+        SELECT {PARTITIONS[granularity]} AS partition, COUNT(*), MIN(date), MAX(date), SUM(hash(t))::VARCHAR
+        FROM {table} t
+        GROUP BY partition
+        ORDER BY partition
+    """).fetchall()
+    return {
+        partition: {"rows": count, "min_date": str(first), "max_date": str(last), "checksum": checksum}
+        for partition, count, first, last, checksum in rows
+    }
+
+def write_partitions(con: DBContext, table: str, table_path: Path, partitions: dict[str, dict], *,
+                     granularity: str, row_group_size: int, compression: str, whole_table: bool = False):
+    """
+    Write the given partitions of table in one PARTITION_BY pass into a
+    staging directory, then move each file into place. Rows are selected by
+    each partition's date range so zone maps skip the unchanged ones, or
+    with one scan and no filter when every partition is written.
+    """
+    staging = table_path.parent / f".{table_path.name}.staging"
+    shutil.rmtree(staging, ignore_errors=True)
+    ranges = " OR ".join(
+        f"date BETWEEN '{stats['min_date']}' AND '{stats['max_date']}'" for stats in partitions.values()
+    )
+    where = "" if whole_table else f"WHERE {ranges}"
+    order = "date, id" if table_dir(table) == "raw" else "date"
+    con.execute(f"""
+        COPY (
+            SELECT *, {PARTITIONS[granularity]} AS {granularity}
+            FROM {table}
+            {where}
+            ORDER BY {order}
+        )
+        TO '{staging.as_posix()}' (
+            FORMAT parquet, PARTITION_BY ({granularity}), WRITE_PARTITION_COLUMNS false,
+            FILENAME_PATTERN 'data', COMPRESSION {compression}, ROW_GROUP_SIZE {row_group_size}
+        )
+    """)
+    for partition in partitions:
+        path = table_path / f"{granularity}={partition}" / "data.parquet"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(staging / f"{granularity}={partition}" / "data0.parquet", path)
+    shutil.rmtree(staging, ignore_errors=True)
+
+def export_table(con: DBContext, table: str, export_dir: str, *, granularity: str = "year",
+                 row_group_size: int = 122_880, compression: str = "zstd", incremental: bool = True,
+                 manifest: dict = None) -> dict:
+    """
+    Write table as one Parquet file per date partition, under
+    export_dir/<table>/<granularity>=<key>/data.parquet, sorted by date so each
+    row group's min/max statistics cover a narrow date range.
+
+    With incremental, only partitions that are new or whose rows changed
+    (row count, date range or checksum differ from the manifest) are rewritten,
+    and partitions no longer in the table are removed. A change of
+    granularity, row group size or compression rewrites the whole table.
+
+    Returns the table's manifest entry.
+    """
+    name = table_dir(table)
+    settings = {"granularity": granularity, "row_group_size": row_group_size, "compression": compression}
+    previous = (manifest or {}).get("tables", {}).get(name)
+    if not incremental or previous is None or previous["settings"] != settings:
+        shutil.rmtree(Path(export_dir) / name, ignore_errors=True)
+        previous = {"partitions": {}}
+
+    stats = partition_stats(con, table, granularity)
+    partitions = {}
+    changed = {}
+    for partition, current in stats.items():
+        path = Path(export_dir) / name / f"{granularity}={partition}" / "data.parquet"
+        known = previous["partitions"].get(partition)
+        if known and all(known[key] == current[key] for key in current) and (Path(export_dir) / known["path"]).exists():
+            partitions[partition] = known
+        else:
+            changed[partition] = current
+            partitions[partition] = {"path": path.relative_to(export_dir).as_posix(), **current}
+
+    if changed:
+        write_partitions(con, table, Path(export_dir) / name, changed, granularity=granularity,
+                         row_group_size=row_group_size, compression=compression,
+                         whole_table=len(changed) == len(stats))
+
+    for partition, known in previous["partitions"].items():
+        if partition not in stats:
+            shutil.rmtree((Path(export_dir) / known["path"]).parent, ignore_errors=True)
+
+    logger.info(f"Exported {table}: {len(changed)} of {len(stats)} partitions written")
+    return {
+        "table": table,
+        "settings": settings,
+        "rows": sum(entry["rows"] for entry in partitions.values()),
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+        "partitions": partitions,
+    }
+
+@staged("export")
+def main(con: DBContext, export_dir: str = "./data/export", tables=EXPORT_TABLES, *, granularity: str = "year",
+         row_group_size: int = 122_880, compression: str = "zstd", incremental: bool = True) -> dict:
+    """
+    Export the pipeline outputs as date-partitioned, compressed Parquet with
+    a manifest (export_dir/manifest.json) mapping each partition to its file,
+    row count and date range.
+    """
+    if granularity not in PARTITIONS:
+        raise ValueError(f"Unknown granularity {granularity!r}, expected one of {list(PARTITIONS)}")
+    Path(export_dir).mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(export_dir)
+    start = time.perf_counter()
+    for table in tables:
+        manifest["tables"][table_dir(table)] = export_table(
+            con, table, export_dir, granularity=granularity, row_group_size=row_group_size,
+            compression=compression, incremental=incremental, manifest=manifest)
+        write_manifest(export_dir, manifest)
+    logger.info(f"Exported {len(tables)} tables to {export_dir} in {time.perf_counter() - start:.2f}s")
+    return manifest
+
+def files_for_range(export_dir: str, table: str, start=None, end=None) -> list[str]:
+    """
+    Parquet files of table holding any date in [start, end], from the manifest
+    alone; pass them to read_parquet / pyarrow.dataset.
+    """
+    manifest = load_manifest(export_dir)
+    entry = manifest["tables"][table_dir(table)]
+    start = str(start) if start is not None else str(date.min)
+    end = str(end) if end is not None else str(date.max)
+    return [
+        (Path(export_dir) / partition["path"]).as_posix()
+        for partition in entry["partitions"].values()
+        if partition["max_date"] >= start and partition["min_date"] <= end
+    ]
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("logs/export.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+    parser = argparse.ArgumentParser(description='Export pipeline outputs as date-partitioned Parquet')
+    parser.add_argument('--output-dir', default='./data/export', help='export directory')
+    parser.add_argument('--tables', nargs='+', default=list(EXPORT_TABLES), help='tables to export')
+    parser.add_argument('--granularity', choices=list(PARTITIONS), default='year', help='date partition size')
+    parser.add_argument('--row-group-size', type=int, default=122_880, help='rows per Parquet row group')
+    parser.add_argument('--compression', default='zstd', help='Parquet compression codec')
+    parser.add_argument('--full', action='store_true', help='rewrite every partition instead of only changed ones')
+    args = parser.parse_args()
+
+    with DBContext(metrics_path="logs/metrics.jsonl", metrics_table="pipeline_metrics") as con:
+        main(con, args.output_dir, args.tables, granularity=args.granularity, row_group_size=args.row_group_size,
+             compression=args.compression, incremental=not args.full)
@@ -1,9 +1,29 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from functools import partial
+import multiprocessing
 import os
 import random
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import math
 
+CSV_HEADER = "id,date,price,trade_volume\n"
+MIN_VOLUME = 1000
+MAX_VOLUME = 500_000_000
+FILE_EXTENSIONS = {"csv": "csv", "parquet": "parquet", "arrow": "arrow"}
+
+# Typed schema matching stocks.raw (id INTEGER, date DATE, price FLOAT, trade_volume INTEGER)
+ARROW_SCHEMA = pa.schema([
+    ("id", pa.int32()),
+    ("date", pa.date32()),
+    ("price", pa.float32()),
+    ("trade_volume", pa.int32()),
+])
+
 # Log-uniform distribution (more realistic for trade volumes)
 def log_uniform(min_val, max_val):
     """Generate a random number with log-uniform distribution."""
@@ -11,13 +31,191 @@ def log_uniform(min_val, max_val):
     log_max = math.log(max_val)
     return int(math.exp(random.uniform(log_min, log_max)))
 
+def random_walk(prices, num_dates, rng, skip_first=False):
+    """
+    Continue the daily price walk from `prices` for `num_dates` dates.
+
+    Returns a (num_dates, num_stocks) array of prices; the last row is the
+    starting point for the next block.
+    """
+    factors = 1 + rng.uniform(-0.02, 0.02, size=(num_dates, len(prices)))
+    if skip_first:
+        factors[0] = 1.0
+    block = prices * np.cumprod(factors, axis=0)
+    if (block < 1.0).any():
+        # The $1 floor makes the walk path dependent, so step through the dates
+        block = np.empty_like(factors)
+        current = prices
+        for i in range(num_dates):
+            current = np.maximum(1.0, current * factors[i])
+            block[i] = current
+    return block
+
+def log_uniform_array(min_val, max_val, size, rng):
+    """Vectorized log_uniform: draw `size` integers in one call."""
+    return np.exp(rng.uniform(math.log(min_val), math.log(max_val), size)).astype(np.int64)
+
+def format_csv_block(ids, dates, prices, volumes):
+    """Format a block of rows as one CSV string (same layout as the python engine)."""
+    rows = np.empty((len(ids), 4), dtype=object)
+    rows[:, 0] = ids.tolist()
+    rows[:, 1] = dates
+    rows[:, 2] = prices.tolist()
+    rows[:, 3] = volumes.tolist()
+    return ("%d,%s,%.2f,%d\n" * len(ids)) % tuple(rows.ravel().tolist())
+
+def price_blocks(prices, num_dates, rng, dates_per_block, skip_first=False):
+    """Yield (start, block) price blocks covering `num_dates` dates."""
+    for start in range(0, num_dates, dates_per_block):
+        block = random_walk(prices, min(dates_per_block, num_dates - start), rng, skip_first=skip_first and start == 0)
+        prices = block[-1]
+        yield start, block
+
+def file_rngs(file_seeds):
+    """Fresh price and volume generators from a file's (price, volume) SeedSequences."""
+    price_seq, volume_seq = file_seeds
+    return np.random.default_rng(price_seq), np.random.default_rng(volume_seq)
+
+def file_start_prices(initial_prices, date_chunks, file_seeds, block_rows=1_000_000):
+    """
+    Replay only the price walk of each file to find where the next one starts.
+
+    This is cheap next to formatting and writing, and lets every file be
+    generated independently while staying price-continuous.
+    """
+    dates_per_block = max(1, block_rows // len(initial_prices))
+    starts = []
+    prices = initial_prices
+    for file_idx, (file_dates, seeds) in enumerate(zip(date_chunks, file_seeds)):
+        starts.append(prices)
+        price_rng, _ = file_rngs(seeds)
+        for _, block in price_blocks(prices, len(file_dates), price_rng, dates_per_block, skip_first=file_idx > 0):
+            prices = block[-1]
+    return starts
+
+def arrow_block(ids, dates, prices, volumes):
+    """Build a typed Arrow table for a block; prices are rounded to cents like the CSV output."""
+    return pa.table({
+        "id": ids.astype(np.int32),
+        "date": dates,
+        "price": np.round(prices, 2).astype(np.float32),
+        "trade_volume": volumes.astype(np.int32),
+    }, schema=ARROW_SCHEMA)
+
+@contextmanager
+def block_writer(filename, file_format="csv", row_group_size=None, compression="zstd"):
+    """
+    Open `filename` and yield a function writing one block of rows per call.
+
+    Args:
+        filename: Output path
+        file_format: "csv", "parquet" or "arrow" (Arrow IPC file)
+        row_group_size: Max rows per Parquet row group / Arrow record batch
+            (defaults to one per block)
+        compression: Parquet/Arrow compression codec, or "none"
+    """
+    codec = None if compression == "none" else compression
+    if file_format == "csv":
+        with open(filename, 'w') as f:
+            f.write(CSV_HEADER)
+            yield lambda ids, dates, prices, volumes: f.write(
+                format_csv_block(ids, dates.astype(str).astype(object), prices, volumes)
+            )
+    elif file_format == "parquet":
+        with pq.ParquetWriter(filename, ARROW_SCHEMA, compression=codec) as writer:
+            yield lambda *block: writer.write_table(arrow_block(*block), row_group_size=row_group_size)
+    elif file_format == "arrow":
+        options = pa.ipc.IpcWriteOptions(compression=codec)
+        with pa.ipc.new_file(filename, ARROW_SCHEMA, options=options) as writer:
+            yield lambda *block: writer.write_table(arrow_block(*block), max_chunksize=row_group_size)
+    else:
+        raise ValueError(f"Unknown file format: {file_format}")
+
+def write_file_vectorized(filename, file_dates, prices, file_seeds, skip_first=False, block_rows=1_000_000,
+                          file_format="csv", row_group_size=None, compression="zstd"):
+    """
+    Write one file in blocks of dates x stocks, one bulk write per block.
+
+    Args:
+        filename: Output path
+        file_dates: Dates covered by this file
+        prices: Price vector carried over from the previous file
+        file_seeds: (price, volume) numpy SeedSequences for this file
+        skip_first: Keep the carried prices on the first date (files after the first)
+        block_rows: Approximate number of rows generated per block
+        file_format: "csv", "parquet" or "arrow"
+        row_group_size: Max rows per Parquet row group / Arrow record batch
+        compression: Parquet/Arrow compression codec, or "none"
+
+    Returns:
+        The output filename
+    """
+    num_stocks = len(prices)
+    dates_per_block = max(1, block_rows // num_stocks)
+    stock_ids = np.arange(1, num_stocks + 1)
+    block_days = file_dates.values.astype('datetime64[D]')
+    price_rng, volume_rng = file_rngs(file_seeds)
+
+    with block_writer(filename, file_format, row_group_size, compression) as write_block:
+        for start, block in price_blocks(prices, len(file_dates), price_rng, dates_per_block, skip_first=skip_first):
+            block_dates = block_days[start:start + len(block)]
+            volumes = log_uniform_array(MIN_VOLUME, MAX_VOLUME, block.size, volume_rng)
+            write_block(
+                np.tile(stock_ids, len(block_dates)),
+                np.repeat(block_dates, num_stocks),
+                block.ravel(),
+                volumes,
+            )
+    return filename
+
+def generate_files_vectorized(date_chunks, initial_prices, file_seeds, output_dir, block_rows=1_000_000, workers=1,
+                              file_format="csv", row_group_size=None, compression="zstd"):
+    """
+    Write one file per date chunk with the vectorized engine, optionally in a process pool.
+
+    Start prices for every file are derived up front, so a fixed seed gives
+    byte-identical files whatever the number of workers.
+    """
+    num_files = len(file_seeds)
+    for file_idx in range(len(date_chunks), num_files):
+        print(f"Warning: Not enough date chunks for file {file_idx+1}. Skipping.")
+    date_chunks = date_chunks[:num_files]
+    start_prices = file_start_prices(initial_prices, date_chunks, file_seeds, block_rows)
+    
+    jobs = []
+    for file_idx, file_dates in enumerate(date_chunks):
+        filename = os.path.join(output_dir, f"stock_data_{file_idx+1}.{FILE_EXTENSIONS[file_format]}")
+        print(f"Generating {filename} with {len(file_dates)} dates × {len(initial_prices)} stocks = {len(file_dates) * len(initial_prices):,} rows")
+        jobs.append((filename, file_dates, start_prices[file_idx], file_seeds[file_idx], file_idx > 0, block_rows))
+    
+    write_file = partial(write_file_vectorized, file_format=file_format,
+                         row_group_size=row_group_size, compression=compression)
+    if workers > 1:
+        # spawned workers do not inherit the caller's threads or locks (e.g. an open DuckDB connection)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(write_file, *job) for job in jobs]
+            filenames = [future.result() for future in futures]
+    else:
+        filenames = [write_file(*job) for job in jobs]
+    
+    for filename in filenames:
+        file_size_mb = os.path.getsize(filename) / (1024 * 1024)
+        print(f"Generated {filename}: {file_size_mb:.2f} MB")
+
 def generate_stock_data_files(
     num_files=3,
     file_size_gb=2,
     num_stocks=200,
     start_date="2000-01-01",
     end_date="2025-12-31",
-    output_dir="./data"
+    output_dir="./data",
+    engine="python",
+    seed=None,
+    block_rows=1_000_000,
+    workers=1,
+    file_format="csv",
+    row_group_size=None,
+    compression="zstd"
 ):
     """
     Generate stock data files with the specified parameters.
@@ -29,8 +227,19 @@ def generate_stock_data_files(
         start_date: Start date for the data
         end_date: End date for the data
         output_dir: Directory to save the generated files
+        engine: "python" (row by row) or "vectorized" (numpy blocks)
+        seed: Random seed for reproducible output
+        block_rows: Rows per block for the vectorized engine
+        workers: Number of processes writing files in parallel (vectorized engine)
+        file_format: "csv", "parquet" or "arrow" (typed formats need the vectorized engine)
+        row_group_size: Max rows per Parquet row group / Arrow record batch
+        compression: Parquet/Arrow compression codec, or "none"
     """
     print(f"Generating {num_files} files of ~{file_size_gb}GB each with {num_stocks} stocks")
+    if workers > 1 and engine != "vectorized":
+        raise ValueError("workers > 1 requires the vectorized engine")
+    if file_format != "csv" and engine != "vectorized":
+        raise ValueError(f"{file_format} output requires the vectorized engine")
     
     # Create output directory if it doesn't exist
     os.makedirs(output_dir, exist_ok=True)
@@ -63,12 +272,24 @@ def generate_stock_data_files(
         dates_per_file = math.ceil(total_dates_needed / num_files)
     
     # Generate initial stock prices (between $10 and $1000)
-    stock_prices = {}
-    for stock_id in range(1, num_stocks + 1):
-        stock_prices[stock_id] = random.uniform(10, 1000)
+    if engine == "vectorized":
+        # One child seed per file so output does not depend on how files are scheduled
+        init_seq, *file_seqs = np.random.SeedSequence(seed).spawn(num_files + 1)
+        file_seeds = [tuple(seq.spawn(2)) for seq in file_seqs]
+        stock_prices = np.random.default_rng(init_seq).uniform(10, 1000, num_stocks)
+    else:
+        random.seed(seed)
+        stock_prices = {}
+        for stock_id in range(1, num_stocks + 1):
+            stock_prices[stock_id] = random.uniform(10, 1000)
     
     date_chunks = [date_range[i:i + dates_per_file] for i in range(0, len(date_range), dates_per_file)]
     
+    if engine == "vectorized":
+        generate_files_vectorized(date_chunks, stock_prices, file_seeds, output_dir, block_rows, workers,
+                                  file_format, row_group_size, compression)
+        return
+    
     # Generate files
     for file_idx in range(num_files):
         if file_idx >= len(date_chunks):
@@ -85,7 +306,7 @@ def generate_stock_data_files(
         
         with open(filename, 'w') as f:
             # Write header
-            f.write("id,date,price,trade_volume\n")
+            f.write(CSV_HEADER)
             
             # Generate data for each date and stock
             for date in file_dates:
@@ -98,7 +319,7 @@ def generate_stock_data_files(
                         stock_prices[stock_id] = max(1.0, stock_prices[stock_id])
                     
                     # Generate realistic trade volume (1,000 to 500,000,000 shares)
-                    trade_volume = log_uniform(1000, 500_000_000)
+                    trade_volume = log_uniform(MIN_VOLUME, MAX_VOLUME)
                     
                     # Write row
                     f.write(f"{stock_id},{date.strftime('%Y-%m-%d')},{stock_prices[stock_id]:.2f},{trade_volume}\n")
@@ -117,6 +338,13 @@ if __name__ == "__main__":
     parser.add_argument("--start-date", type=str, default="1970-01-01", help="Start date (YYYY-MM-DD)")
     parser.add_argument("--end-date", type=str, default="2025-12-31", help="End date (YYYY-MM-DD)")
     parser.add_argument("--output-dir", type=str, default="./data", help="Output directory")
+    parser.add_argument("--engine", choices=["python", "vectorized"], default="python", help="Row-by-row or numpy block generation")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible output")
+    parser.add_argument("--workers", type=int, default=1, help="Processes writing files in parallel (vectorized engine)")
+    parser.add_argument("--format", choices=list(FILE_EXTENSIONS), default="csv", help="Output file format")
+    parser.add_argument("--row-group-size", type=int, default=None, help="Max rows per Parquet row group / Arrow record batch")
+    parser.add_argument("--compression", type=str, default="zstd", help="Parquet/Arrow compression codec (or none)")
+    parser.add_argument("--block-rows", type=int, default=1_000_000, help="Rows per block for the vectorized engine")
     
     args = parser.parse_args()
     
@@ -126,5 +354,12 @@ if __name__ == "__main__":
         num_stocks=args.num_stocks,
         start_date=args.start_date,
         end_date=args.end_date,
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        engine=args.engine,
+        seed=args.seed,
+        block_rows=args.block_rows,
+        workers=args.workers,
+        file_format=args.format,
+        row_group_size=args.row_group_size,
+        compression=args.compression
     )
\ No newline at end of file
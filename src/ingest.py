@@ -1,48 +1,350 @@
+import argparse
+import hashlib
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from src.config import DBContext 
+
+import duckdb
+import pyarrow.dataset as ds
+
+from src.config import DBContext, staged
 
 logger = logging.getLogger(__name__)
- 
-def process_file_by_file(con: DBContext, input_dir: str):
+
+INPUT_PATTERNS = ("*.csv", "*.parquet", "*.arrow")
+RAW_COLUMNS = "id, date, price, trade_volume"
+CSV_COLUMNS = "{'id': 'INTEGER', 'date': 'DATE', 'price': 'FLOAT', 'trade_volume': 'INTEGER'}"
+
+RAW_TABLE = """
+    stocks.raw
+        (id INTEGER,
+        date DATE,
+        price FLOAT,
+        trade_volume INTEGER,
+        file_id INTEGER
+        )
+"""
+
+# one row per ingested file; batch_id is the ingest run that last loaded it
+MANIFEST_TABLE = """
+    stocks.ingest_manifest
+        (file_id INTEGER PRIMARY KEY,
+        path VARCHAR,
+        size BIGINT,
+        mtime_ns BIGINT,
+        content_hash VARCHAR,
+        batch_id INTEGER,
+        row_count BIGINT,
+        ingested_at TIMESTAMP DEFAULT current_timestamp
+        )
+"""
+
+# stock ids present in stocks.raw, read by DBContext.SYMBOLS
+SYMBOLS_TABLE = """
+    stocks.symbols
+        (id INTEGER PRIMARY KEY
+        )
+"""
+
+def raw_connection(con) -> duckdb.DuckDBPyConnection:
+    """The underlying connection, for bookkeeping reads kept out of the logs and metrics"""
+    return con.con if isinstance(con, DBContext) else con
+
+def file_hash(file_path: Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def scan_sql(files: list[tuple[Path, int]], register) -> tuple[str, list[str]]:
+    """
+    Build one SELECT over a set of input files, using a multi-file scan per format.
+    Every row is tagged with the file_id of the file it came from.
+
+    Args:
+        files: (input file, file_id) pairs; .csv, .parquet or .arrow
+        register: register(name, obj) of the connection that will run the query,
+            used to expose Arrow IPC files
+
+    Returns the query and the names it registered, to unregister once it ran.
+    """
+    by_suffix: dict[str, list[tuple[str, int]]] = {}
+    for file_path, file_id in files:
+        by_suffix.setdefault(file_path.suffix, []).append((file_path.as_posix(), file_id))
+
+    scans = []
+    views = []
+    for suffix, entries in by_suffix.items():
+        if suffix == ".arrow":
+            # a dataset streams record batches into the scan instead of reading whole files into memory
+            for path, file_id in entries:
+                register(f"arrow_input_{file_id}", ds.dataset(path, format="ipc"))
+                views.append(f"arrow_input_{file_id}")
+                scans.append(f"SELECT {RAW_COLUMNS}, {file_id} AS file_id FROM arrow_input_{file_id}")
+            continue
+
+        paths = [path for path, _ in entries]
+        if suffix == ".parquet":
+            reader = f"read_parquet({paths!r}, filename=true)"
+        else:
+            reader = f"read_csv({paths!r}, header=true, delim=',', columns={CSV_COLUMNS}, filename=true)"
+        file_ids = ", ".join(f"('{path}', {file_id})" for path, file_id in entries)
+        scans.append(f"""
+            SELECT s.id, s.date, s.price, s.trade_volume, m.file_id
+            FROM {reader} s
+            JOIN (VALUES {file_ids}) m(filename, file_id) ON s.filename = m.filename
+        """)
+    return " UNION ALL ".join(scans), views
+
+def log_throughput(label: str, rows: int, size_bytes: int, seconds: float):
+    seconds = max(seconds, 1e-9)
+    size_mb = size_bytes / 1024 / 1024
+    logger.info(
+        f"{label}: {rows:,} rows, {size_mb:.2f} MB in {seconds:.2f}s "
+        f"({rows / seconds:,.0f} rows/s, {size_mb / seconds:.2f} MB/s)"
+    )
+
+def plan_files(con: DBContext, input_files: list[Path]) -> list[dict]:
+    """
+    Compare input files with stocks.ingest_manifest.
+
+    Files whose size and mtime match the manifest are unchanged without being
+    read; otherwise the content hash decides between "touched" (same content)
+    and "changed". Unknown paths are "new" and get the next file_id.
+
+    A file is only hashed once its size or mtime differ from the manifest, so
+    new files are recorded with a NULL hash and count as "changed" the first
+    time they differ; the hash stored then detects later touches.
+    """
+    manifest = {
+        row[0]: row[1:]
+        for row in con.con.execute(
+            "SELECT path, file_id, size, mtime_ns, content_hash FROM stocks.ingest_manifest"
+        ).fetchall()
+    }
+    next_file_id = max((entry[0] for entry in manifest.values()), default=0) + 1
+
+    entries = []
+    for file_path in input_files:
+        key = file_path.resolve().as_posix()
+        stat = file_path.stat()
+        entry = {"path": file_path, "key": key, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        known = manifest.pop(key, None)
+        if known is None:
+            entry.update(file_id=next_file_id, content_hash=None, status="new")
+            next_file_id += 1
+        elif known[1:3] == (stat.st_size, stat.st_mtime_ns):
+            entry.update(file_id=known[0], content_hash=known[3], status="unchanged")
+        else:
+            content_hash = file_hash(file_path)
+            status = "touched" if known[3] is not None and content_hash == known[3] else "changed"
+            entry.update(file_id=known[0], content_hash=content_hash, status=status)
+        entries.append(entry)
+
+    for missing in manifest:
+        logger.warning(f"{missing} is in the manifest but no longer in the input directory; its rows are kept")
+    return entries
+
+def record_files(con, entries: list[dict], batch_id: int, row_counts: dict[int, int]):
+    """Upsert manifest rows for loaded files (con may be a DBContext or a cursor)"""
+    values = ", ".join(
+        f"({e['file_id']}, '{e['key']}', {e['size']}, {e['mtime_ns']}, "
+        f"{f"'{e['content_hash']}'" if e['content_hash'] else 'NULL'}, "
+        f"{batch_id}, {row_counts.get(e['file_id'], 0)}, current_timestamp)"
+        for e in entries
+    )
+    con.execute(f"INSERT OR REPLACE INTO stocks.ingest_manifest VALUES {values}")
+
+def replace_files(con, entries: list[dict], batch_id: int, cluster: bool = False) -> dict[int, int]:
+    """
+    Atomically swap the rows of `entries` in stocks.raw: delete whatever the
+    files loaded before, insert their current contents and update the manifest,
+    all in one transaction. With cluster, the new rows are inserted sorted by
+    (id, date). Returns rows loaded per file_id.
+    """
+    file_ids = ", ".join(str(e["file_id"]) for e in entries)
+    scan, views = scan_sql([(e['path'], e['file_id']) for e in entries], con.register)
+    order = "ORDER BY id, date" if cluster else ""
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"DELETE FROM stocks.raw WHERE file_id IN ({file_ids})")
+        con.execute(f"INSERT INTO stocks.raw SELECT * FROM ({scan}) {order}")
+        row_counts = dict(raw_connection(con).execute(f"""
+            SELECT file_id, COUNT(*) FROM stocks.raw WHERE file_id IN ({file_ids}) GROUP BY file_id
+        """).fetchall())
+        record_files(con, entries, batch_id, row_counts)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        for view in views:
+            con.unregister(view)
+    return row_counts
+
+def load_file_by_file(con: DBContext, entries: list[dict], batch_id: int, cluster: bool = False) -> int:
+    """One statement per file, in order; per-file throughput is exact."""
+    total_rows = 0
+    for entry in entries:
+        print(f"Processing file: {entry['path']}")
+        start = time.perf_counter()
+        rows = replace_files(con, [entry], batch_id, cluster).get(entry["file_id"], 0)
+        log_throughput(entry["path"].name, rows, entry["size"], time.perf_counter() - start)
+        total_rows += rows
+    return total_rows
+
+def load_bulk(con: DBContext, entries: list[dict], batch_id: int, max_concurrency: int = 1,
+              cluster: bool = False) -> int:
+    """
+    Load all files in a single INSERT ... SELECT over a multi-file scan, or with
+    max_concurrency > 1 one statement per file on separate cursors, at most
+    max_concurrency at a time. All statements share the DuckDB thread pool
+    (PRAGMA threads = cpu_count).
+    """
+    # Unless the rows are inserted sorted, their order in stocks.raw is not relied upon and
+    # dropping it lets scans run fully parallel. Restored afterwards so later stages keep the default.
+    preserve_order = con.con.execute("SELECT current_setting('preserve_insertion_order')").fetchone()[0]
+    if not cluster:
+        con.execute("SET preserve_insertion_order = false")
+
+    def load_one(entry: dict) -> int:
+        cursor = con.cursor()
+        try:
+            start = time.perf_counter()
+            rows = replace_files(cursor, [entry], batch_id, cluster).get(entry["file_id"], 0)
+            log_throughput(entry["path"].name, rows, entry["size"], time.perf_counter() - start)
+            return rows
+        finally:
+            cursor.close()
+
+    try:
+        if max_concurrency <= 1:
+            row_counts = replace_files(con, entries, batch_id, cluster)
+            for entry in entries:
+                logger.info(f"{entry['path'].name}: {row_counts.get(entry['file_id'], 0):,} rows, "
+                            f"{entry['size'] / 1024 / 1024:.2f} MB")
+            return sum(row_counts.values())
+
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+            return sum(pool.map(load_one, entries))
+    finally:
+        con.execute(f"SET preserve_insertion_order = {preserve_order}")
+
+def cluster_raw(con: DBContext):
+    """
+    Rewrite stocks.raw ordered by (id, date). Each row group then covers a
+    narrow id range, so the per-batch `WHERE id ...` filters in transform can
+    skip row groups through their min/max zone maps instead of scanning the
+    whole table.
+    """
+    con.execute("CREATE OR REPLACE TABLE stocks.raw AS SELECT * FROM stocks.raw ORDER BY id, date")
+    logger.info("Clustered stocks.raw by (id, date)")
+
+def record_symbols(con: DBContext) -> int:
+    """
+    Store the distinct ids of stocks.raw in stocks.symbols, so transform,
+    returns and verify use the ingested symbol universe. Returns the count.
+    """
+    con.execute(f"CREATE OR REPLACE TABLE {SYMBOLS_TABLE}")
+    con.execute("INSERT INTO stocks.symbols SELECT DISTINCT id FROM stocks.raw ORDER BY id")
+    con.reset_symbols()
+    symbols = len(con.SYMBOLS)
+    logger.info(f"Recorded {symbols} symbols in stocks.symbols")
+    return symbols
+
+@staged("ingest")
+def process_file_by_file(con: DBContext, input_dir: str, mode: str = "file", max_concurrency: int = 1,
+                         incremental: bool = False, cluster: bool = False, close: bool = True):
     """
     Process stock data files and insert into separate tables for each stock.
-    
+
     Args:
         con: DuckDB connection object
-        memory_limit: DuckDB memory limit in GB
+        input_dir: Directory with .csv / .parquet / .arrow input files
+        mode: "file" (one statement per file) or "bulk" (multi-file / concurrent statements)
+        max_concurrency: Concurrent statements in bulk mode, capped at con.cpu_count
+        incremental: Keep stocks.raw and only load files that are new or changed
+            according to stocks.ingest_manifest
+        cluster: Store stocks.raw sorted by (id, date): a full load sorts the
+            whole table once, an incremental load inserts each new batch sorted
+            instead of rewriting the rows already stored
+        close: Close the connection when done
     """
- 
-    input_files = list(Path(input_dir).glob("*.csv"))
+
+    input_files = [path for pattern in INPUT_PATTERNS for path in Path(input_dir).glob(pattern)]
     logger.info([(x,y) for x,y in enumerate(input_files)])
 
     if not input_files:
         logger.error("No input files found!")
-        raise Exception("No input files found!") 
+        raise Exception("No input files found!")
 
-    con.execute(f"""
-        CREATE OR REPLACE TABLE stocks.raw
-            (id INTEGER,
-            date DATE,
-            price FLOAT,
-            trade_volume INTEGER
-            )
-    """)
+    if incremental:
+        con.execute(f"CREATE TABLE IF NOT EXISTS {RAW_TABLE}")
+        con.execute(f"CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE}")
+        untracked = con.con.execute("SELECT COUNT(*) FROM stocks.raw WHERE file_id IS NULL").fetchone()[0]
+        if untracked:
+            raise Exception(f"stocks.raw has {untracked} rows not tracked by the manifest; run a full ingest first")
+    else:
+        con.execute(f"CREATE OR REPLACE TABLE {RAW_TABLE}")
+        con.execute(f"CREATE OR REPLACE TABLE {MANIFEST_TABLE}")
 
-    for file_path in input_files:
-        print(f"Processing file: {file_path}")
+    entries = plan_files(con, input_files)
+    for status in ("new", "changed", "touched", "unchanged"):
+        files = [e["path"].name for e in entries if e["status"] == status]
+        if files:
+            logger.info(f"{status}: {files}")
 
-        file_path_str = file_path.as_posix()
+    touched = [e for e in entries if e["status"] == "touched"]
+    if touched:
         con.execute(f"""
-            COPY stocks.raw FROM '{file_path_str}' WITH (HEADER, DELIMITER ',', FORMAT CSV)
-            """) # assumes each files has the same schema
+            UPDATE stocks.ingest_manifest SET mtime_ns = t.mtime_ns
+            FROM (VALUES {', '.join(f"({e['file_id']}, {e['mtime_ns']})" for e in touched)}) t(file_id, mtime_ns)
+            WHERE stocks.ingest_manifest.file_id = t.file_id
+        """)
 
-    con.close()
+    to_load = [e for e in entries if e["status"] in ("new", "changed")]
+    if not to_load:
+        logger.info("No new or changed files to ingest")
+        if not con.con.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE database_name = 'stocks' AND table_name = 'symbols'").fetchone()[0]:
+            record_symbols(con)
+        if close:
+            con.close()
+        return
+
+    batch_id = con.con.execute("SELECT COALESCE(MAX(batch_id), 0) + 1 FROM stocks.ingest_manifest").fetchone()[0]
+    start = time.perf_counter()
+    if mode == "bulk":
+        rows = load_bulk(con, to_load, batch_id, max_concurrency=min(max_concurrency, con.cpu_count),
+                         cluster=cluster and incremental)
+    else:
+        rows = load_file_by_file(con, to_load, batch_id, cluster=cluster and incremental)
+    total_bytes = sum(e["size"] for e in to_load)
+    log_throughput(f"Ingested {len(to_load)} files ({mode}, batch {batch_id})", rows, total_bytes,
+                   time.perf_counter() - start)
+    record_symbols(con)
+    if cluster and not incremental:
+        cluster_raw(con)
+
+    if close:
+        con.close()
 
 if __name__ == "__main__":
     FILE_DIR = os.environ['CSV_FILE_DIR']
 
+    parser = argparse.ArgumentParser(description='Ingest stock data files')
+    parser.add_argument('--mode', choices=['file', 'bulk'], default='file',
+                        help='one statement per file, or bulk multi-file / concurrent statements')
+    parser.add_argument('--max-concurrency', type=int, default=1,
+                        help='concurrent INSERT statements in bulk mode (1 = single statement)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only load new or changed files, keeping the rest of stocks.raw')
+    parser.add_argument('--cluster', action='store_true',
+                        help='store stocks.raw sorted by (id, date) so transform batches can skip row groups')
+    args = parser.parse_args()
+
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -51,8 +353,7 @@ if __name__ == "__main__":
             logging.StreamHandler()
         ]
     )
-    
-    conn = DBContext(profile=True)
-    process_file_by_file(conn, input_dir=FILE_DIR)
 
-    
\ No newline at end of file
+    conn = DBContext(profile=True, metrics_path="logs/metrics.jsonl", metrics_table="pipeline_metrics")
+    process_file_by_file(conn, input_dir=FILE_DIR, mode=args.mode, max_concurrency=args.max_concurrency,
+                         incremental=args.incremental, cluster=args.cluster)
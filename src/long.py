@@ -0,0 +1,166 @@
+import argparse
+import logging
+from src.config import DBContext, drop_other_kind, staged, timed_growth
+from src import returns, transform
+from src.transform import mismatched_rows
+
+logger = logging.getLogger(__name__)
+
+# long (id, date, value) tables sorted by (id, date), and the wide table each stands in for
+LONG_TABLES = {
+    "price": ("price_long", "price_wide"),
+    "trade_volume": ("trade_volume_long", "trade_volume_wide"),
+    "returns": ("returns_long", "stock_returns"),
+}
+
+def create_long_tables(con: DBContext, source_table="stocks.raw", table_suffix: str = ""):
+    """
+    Build price_long and trade_volume_long from one scan of source_table.
+    Duplicate (id, date) rows keep the MAX, like the wide engines.
+    """
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE long_source AS
+        SELECT id, date, MAX(price) AS price, MAX(trade_volume) AS trade_volume
+        FROM {source_table}
+        GROUP BY id, date
+    """)
+    for field in transform.FIELDS:
+        table_name = f"{LONG_TABLES[field][0]}{table_suffix}"
+        con.execute(f"""
+            CREATE OR REPLACE TABLE {table_name} AS
+            SELECT id, date, {field} AS value
+            FROM long_source
+            ORDER BY id, date
+        """)
+        logger.info(f"Created {table_name}")
+    con.execute("DROP TABLE long_source")
+
+def calculate_returns(con: DBContext, table_suffix: str = ""):
+    """
+    One-day returns per id with PARTITION BY id. A return is only computed
+    when the id also has a price on the preceding date of the whole date set,
+    so a missing price gives NULL returns exactly as in the wide layout.
+    """
+    price_table = f"{LONG_TABLES['price'][0]}{table_suffix}"
+    table_name = f"{LONG_TABLES['returns'][0]}{table_suffix}"
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {table_name} AS
+        WITH days AS (
+            SELECT date, ROW_NUMBER() OVER (ORDER BY date) AS day
+            FROM (SELECT DISTINCT date FROM {price_table})
+        ),
+        lagged AS (
+            SELECT id, date, day, value,
+                LAG(value) OVER w AS prev_value, LAG(day) OVER w AS prev_day
+            FROM {price_table} JOIN days USING (date)
+            WINDOW w AS (PARTITION BY id ORDER BY day)
+        )
+        SELECT id, date,
+            (CASE WHEN prev_day = day - 1 THEN (value - prev_value) / NULLIF(prev_value, 0) * 100 END)::FLOAT AS value
+        FROM lagged
+        ORDER BY id, date
+    """)
+    logger.info(f"Calculated returns into {table_name}")
+
+def wide_sql(con: DBContext, long_table: str) -> str:
+    """PIVOT of a long table into the date x stk_<id> layout"""
+    symbols = ", ".join(f"'stk_{id}'" for id in con.SYMBOLS)
+    return f"""
+        PIVOT (
+            SELECT date, 'stk_' || id AS symbol, value
+            FROM {long_table}
+            WHERE id IN ({','.join(str(id) for id in con.SYMBOLS)})
+        )
+        ON symbol IN ({symbols})
+        USING MAX(value)
+        GROUP BY date
+        ORDER BY date
+    """
+
+def export_wide(con: DBContext, long_table: str, table_name: str, view: bool = False):
+    """
+    Expose a long table in the wide layout, either as a view pivoted on every
+    read or as a table materialised once.
+    """
+    kind = "VIEW" if view else "TABLE"
+    drop_other_kind(con, table_name, kind)
+    con.execute(f"CREATE OR REPLACE {kind} {table_name} AS {wide_sql(con, long_table)}")
+    logger.info(f"Exported {long_table} as {kind.lower()} {table_name}")
+
+@staged("long")
+def main(con: DBContext, *, source_table="stocks.raw", table_suffix: str = "", wide: str = None):
+    """
+    Store prices, volumes and returns in the long layout.
+
+    Args:
+        con: DBContext
+        source_table: long (id, date, price, trade_volume) table
+        table_suffix: appended to every table name, to build into scratch tables
+        wide: None, "view" or "table"; also expose each long table under the
+            name of its wide counterpart (price_wide, trade_volume_wide,
+            stock_returns), replacing it
+    """
+    create_long_tables(con, source_table=source_table, table_suffix=table_suffix)
+    calculate_returns(con, table_suffix=table_suffix)
+    if wide:
+        for long_table, wide_table in LONG_TABLES.values():
+            export_wide(con, f"{long_table}{table_suffix}", f"{wide_table}{table_suffix}", view=wide == "view")
+
+def compare_layouts(con: DBContext, *, source_table="stocks.raw") -> dict:
+    """
+    Build prices, volumes and returns in the wide layout (pivot + window
+    engines) and in the long layout, timing each with timed_growth, and check
+    that the long tables pivot back to the same wide tables.
+    """
+    def wide_layout():
+        transform.main(con, field="all", source_table=source_table, engine="pivot", table_suffix="_wide_layout")
+        con.execute(f"CREATE OR REPLACE TABLE stock_returns_wide_layout AS "
+                    f"{returns.returns_sql(con, source_table='price_wide_wide_layout')}")
+
+    runs = {
+        "wide": timed_growth(wide_layout),
+        "long": timed_growth(lambda: main(con, source_table=source_table, table_suffix="_long_layout")),
+    }
+
+    mismatched = 0
+    for long_table, wide_table in LONG_TABLES.values():
+        export_wide(con, f"{long_table}_long_layout", f"{wide_table}_long_layout", view=True)
+        mismatched += mismatched_rows(con, f"{wide_table}_wide_layout", f"{wide_table}_long_layout")
+        con.execute(f"DROP VIEW {wide_table}_long_layout")
+        con.execute(f"DROP TABLE {wide_table}_wide_layout")
+        con.execute(f"DROP TABLE {long_table}_long_layout")
+
+    (wide_time, wide_mb), (long_time, long_mb) = runs["wide"], runs["long"]
+    logger.info(
+        f"layouts: wide {wide_time:.2f}s / +{wide_mb:.0f} MB, long {long_time:.2f}s / +{long_mb:.0f} MB "
+        f"({wide_time / max(long_time, 1e-9):.1f}x), {mismatched} mismatched rows"
+    )
+    return {
+        "mismatched_rows": mismatched,
+        "wide_seconds": wide_time, "long_seconds": long_time,
+        "wide_growth_mb": wide_mb, "long_growth_mb": long_mb,
+    }
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("logs/long.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+    parser = argparse.ArgumentParser(description='Store prices, volumes and returns as long (id, date, value) tables')
+    parser.add_argument('--wide', choices=['view', 'table'], default=None,
+                        help='also replace price_wide, trade_volume_wide and stock_returns with views / tables over the long tables')
+    parser.add_argument('--compare', action='store_true',
+                        help='time the wide and long layouts and check they produce the same tables')
+    args = parser.parse_args()
+
+    with DBContext(profile=True, metrics_path="logs/metrics.jsonl", metrics_table="pipeline_metrics") as con:
+        if args.compare:
+            compare_layouts(con)
+        else:
+            main(con, wide=args.wide)
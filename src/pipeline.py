@@ -0,0 +1,158 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from src import analytics, ingest, returns, transform
+from src.config import DBContext
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("ingest", "transform", "returns", "analytics")
+
+# input fingerprint each stage last ran with
+STATE_TABLE = """
+    pipeline_state
+        (stage VARCHAR PRIMARY KEY,
+        fingerprint VARCHAR,
+        seconds DOUBLE,
+        updated_at TIMESTAMP
+        )
+"""
+
+
+def digest(value) -> str:
+    return hashlib.blake2b(json.dumps(value, default=str, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+def tables_exist(con: DBContext, tables: list[str]) -> bool:
+    names = ", ".join(f"'{table.split('.')[-1]}'" for table in tables)
+    found = con.con.execute(f"SELECT COUNT(DISTINCT table_name) FROM duckdb_tables() WHERE table_name IN ({names})").fetchone()[0]
+    return found == len(tables)
+
+def wide_state(con: DBContext, table_name: str):
+    return transform.table_state(con, table_name) if tables_exist(con, [table_name]) else None
+
+def ingest_fingerprint(con: DBContext, input_dir: str, options: dict) -> str:
+    """Path, size and mtime of every input file: what ingest's manifest compares without reading them"""
+    files = sorted(
+        (path.resolve().as_posix(), stat.st_size, stat.st_mtime_ns)
+        for pattern in ingest.INPUT_PATTERNS
+        for path in Path(input_dir).glob(pattern)
+        for stat in (path.stat(),)
+    )
+    return digest({"files": files, **options})
+
+def transform_fingerprint(con: DBContext, options: dict) -> str:
+    """Ingest batches and files behind stocks.raw, and the symbol set"""
+    manifest = con.con.execute("""
+        SELECT MAX(batch_id), COUNT(*), SUM(row_count), MAX(ingested_at) FROM stocks.ingest_manifest
+    """).fetchone()
+    return digest({"manifest": manifest, "symbols": con.SYMBOLS, **options})
+
+def returns_fingerprint(con: DBContext, options: dict) -> str:
+    """The price_wide build (ingest batch, generation) returns would be computed from"""
+    return digest({"price_wide": wide_state(con, "price_wide"), **options})
+
+def analytics_fingerprint(con: DBContext, options: dict) -> str:
+    return digest({table: wide_state(con, table) for table in ("price_wide", "trade_volume_wide")} | options)
+
+def stage_state(con: DBContext, stage: str):
+    if not tables_exist(con, ["pipeline_state"]):
+        return None
+    row = con.con.execute(f"SELECT fingerprint FROM pipeline_state WHERE stage = '{stage}'").fetchone()
+    return row[0] if row else None
+
+def record_stage(con: DBContext, stage: str, fingerprint: str, seconds: float):
+    con.execute(f"CREATE TABLE IF NOT EXISTS {STATE_TABLE}")
+    con.execute(f"""
+        INSERT OR REPLACE INTO pipeline_state
+        VALUES ('{stage}', '{fingerprint}', {seconds}, current_timestamp)
+    """)
+
+def run(con: DBContext, input_dir: str, *, stages=STAGES, force: bool = False, ingest_mode: str = "bulk",
+        cluster: bool = False, transform_engine: str = "pivot", returns_engine: str = "window",
+        metrics=analytics.DEFAULT_METRICS) -> list[dict]:
+    """
+    Run the pipeline stages in order on one connection. Each stage records a
+    fingerprint of its inputs in pipeline_state and is skipped when the
+    fingerprint is unchanged and its outputs exist. Stages that do run are
+    incremental where they can be: ingest loads new / changed files only,
+    transform and returns rewrite only the dates that changed. With force,
+    every stage runs and rebuilds its outputs in full.
+
+    The two transforms are not run as separate concurrent statements: both
+    wide tables are built from the same scans of stocks.raw (field="all"),
+    which reads the source once instead of twice.
+
+    Returns one {"stage", "status", "seconds"} dict per stage.
+    """
+    steps = {
+        "ingest": (
+            lambda: ingest_fingerprint(con, input_dir, {"cluster": cluster}),
+            ["stocks.raw", "stocks.ingest_manifest"],
+            lambda: ingest.process_file_by_file(
+                con, input_dir=input_dir, mode=ingest_mode,
+                incremental=not force and tables_exist(con, ["stocks.ingest_manifest"]),
+                cluster=cluster, close=False),
+        ),
+        "transform": (
+            lambda: transform_fingerprint(con, {"engine": transform_engine}),
+            ["price_wide", "trade_volume_wide"],
+            lambda: transform.main(con, field="all", engine=transform_engine, incremental=not force),
+        ),
+        "returns": (
+            lambda: returns_fingerprint(con, {"engine": returns_engine}),
+            ["stock_returns"],
+            lambda: returns.calculate_returns(con, engine=returns_engine, incremental=not force),
+        ),
+        "analytics": (
+            lambda: analytics_fingerprint(con, {"metrics": sorted(metrics)}),
+            [analytics.metric_table(metric) for metric in metrics],
+            lambda: analytics.main(con, metrics=list(metrics)),
+        ),
+    }
+
+    report = []
+    for stage in stages:
+        fingerprint_fn, outputs, step = steps[stage]
+        start = time.perf_counter()
+        fingerprint = fingerprint_fn()
+        if not force and stage_state(con, stage) == fingerprint and tables_exist(con, outputs):
+            logger.info(f"{stage}: inputs unchanged, skipped")
+            report.append({"stage": stage, "status": "cached", "seconds": time.perf_counter() - start})
+            continue
+        step()
+        seconds = time.perf_counter() - start
+        record_stage(con, stage, fingerprint, seconds)
+        report.append({"stage": stage, "status": "ran", "seconds": seconds})
+        logger.info(f"{stage}: ran in {seconds:.2f}s")
+
+    for entry in report:
+        logger.info(f"{entry['stage']:<10} {entry['status']:<6} {entry['seconds']:8.2f}s")
+    logger.info(f"pipeline: {sum(entry['seconds'] for entry in report):.2f}s, "
+                f"{sum(entry['status'] == 'cached' for entry in report)} of {len(report)} stages cached")
+    return report
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("logs/pipeline.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+    parser = argparse.ArgumentParser(description='Run ingest, transform, returns and analytics in one process')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES), help='stages to run, in order')
+    parser.add_argument('--force', action='store_true', help='rebuild every stage in full even if its inputs are unchanged')
+    parser.add_argument('--cluster', action='store_true', help='store stocks.raw sorted by (id, date)')
+    parser.add_argument('--metrics', nargs='+', default=list(analytics.DEFAULT_METRICS), help='analytics metrics')
+    args = parser.parse_args()
+
+    with DBContext(profile=True, metrics_path="logs/metrics.jsonl", metrics_table="pipeline_metrics") as con:
+        run(con, os.environ['CSV_FILE_DIR'], stages=args.stages, force=args.force, cluster=args.cluster,
+            metrics=args.metrics)
@@ -0,0 +1,114 @@
+import argparse
+import logging
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import duckdb
+
+from src.config import DBContext, stock_columns, wide_query
+
+logger = logging.getLogger(__name__)
+
+
+class ReadPool:
+    """
+    A fixed set of connections for concurrent reads of the pipeline database,
+    handed out to one thread at a time.
+
+    With con, the pool holds cursors of that DBContext: readers see every
+    committed write and never wait for the writer's open transactions (DuckDB
+    MVCC). Without it, the pool opens db_path read-only, which lets
+    dashboards and backtests read while no writer process holds the file.
+
+    threads and memory_limit (GB) apply to the whole DuckDB database, so a
+    read-only pool sets them once; by default each of the `size` concurrent
+    queries gets an equal share of cpu_count threads.
+    """
+    def __init__(self, db_path: str = './data/stocks.duckdb', size: int = 4, *, con: DBContext = None,
+                 cpu_count: int = 4, threads: int = None, memory_limit: float = None):
+        self.size = size
+        if con is not None:
+            self.base = None
+            connections = [con.cursor() for _ in range(size)]
+        else:
+            self.base = duckdb.connect(db_path, read_only=True)
+            self.base.execute(f"PRAGMA threads={threads or max(cpu_count // size, 1)}")
+            if memory_limit:
+                self.base.execute(f"PRAGMA memory_limit='{memory_limit}GB'")
+            connections = [self.base.cursor() for _ in range(size)]
+        self._idle: queue.Queue = queue.Queue()
+        for connection in connections:
+            self._idle.put(connection)
+        self._connections = connections
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def close(self):
+        for connection in self._connections:
+            connection.close()
+        if self.base is not None:
+            self.base.close()
+        self._connections = []
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, waiting until one is free"""
+        connection = self._idle.get()
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+    def query(self, sql: str, fetch: str = "arrow"):
+        """Run one read on a pooled connection; fetch as in DBContext.execute (except "reader")"""
+        with self.connection() as connection:
+            return DBContext.fetch(connection.execute(sql), fetch)
+
+    def map(self, queries: list[str], fetch: str = "arrow") -> list:
+        """Run independent reads concurrently, one per pooled connection at a time, in order"""
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            results = list(executor.map(lambda sql: self.query(sql, fetch), queries))
+        logger.info(f"{len(queries)} queries on {self.size} connections in {time.perf_counter() - start:.2f}s")
+        return results
+
+    def read_wide(self, table: str, *, symbols: list[int] = None, chunk_size: int = 20, start=None, end=None,
+                  fetch: str = "arrow") -> list:
+        """
+        Read a wide table as consecutive symbol ranges of chunk_size ids,
+        fetched concurrently. Returns one result per range, in symbol order.
+        """
+        with self.connection() as connection:
+            if symbols is None:
+                symbols = [int(column.removeprefix("stk_")) for column in stock_columns(connection, table)]
+            queries = [wide_query(connection, table, start=start, end=end, symbols=symbols[i:i + chunk_size])
+                       for i in range(0, len(symbols), chunk_size)]
+        return self.map(queries, fetch=fetch)
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("logs/pool.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+    parser = argparse.ArgumentParser(description='Read a wide table concurrently through a read-only connection pool')
+    parser.add_argument('--table', default='stock_returns', help='wide table to read')
+    parser.add_argument('--size', type=int, default=4, help='pooled connections')
+    parser.add_argument('--chunk-size', type=int, default=20, help='symbols per query')
+    args = parser.parse_args()
+
+    with ReadPool(size=args.size) as pool:
+        results = pool.read_wide(args.table, chunk_size=args.chunk_size)
+        logger.info(f"Read {sum(result.num_columns - 1 for result in results)} columns of {args.table}")
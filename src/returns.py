@@ -1,35 +1,169 @@
 import argparse
 import logging
-from src.config import DBContext
+import time
+from src.config import AdaptiveBatcher, DBContext, drop_other_kind, staged
+from src.transform import mismatched_rows, table_state
 
 logger = logging.getLogger(__name__)
 
+# price_wide ingest batch and generation each returns table was last computed from
+STATE_TABLE = """
+    returns_state
+        (table_name VARCHAR PRIMARY KEY,
+        source_batch_id INTEGER,
+        source_generation INTEGER,
+        updated_at TIMESTAMP
+        )
+"""
 
-def create_table(con: DBContext):
+
+def create_table(con: DBContext, table_name: str = "stock_returns"):
     # Create stock_returns tablee
     columns = ["date DATE PRIMARY KEY"]
-    for symbol in DBContext.STOCK_COLUMNS:
+    for symbol in con.STOCK_COLUMNS:
         columns.append(f"{symbol} FLOAT")    
     try:
         str_columns = ', '.join(columns)
-        con.execute(f"CREATE OR REPLACE TABLE stock_returns ({str_columns})")
-        logger.info(f"Successfully created stock_returns table")
+        drop_other_kind(con, table_name)
+        con.execute(f"CREATE OR REPLACE TABLE {table_name} ({str_columns})")
+        logger.info(f"Successfully created {table_name} table")
     except Exception as e:
         logger.error(f"Failed to create tables: {e}")
         raise        
     
-def calculate_returns(con: DBContext, batch_size=20):
-    """Calculate returns for all stocks using batch processing similar to transform.py"""
+def returns_sql(con: DBContext, source_table: str = "price_wide", dates_table: str = None) -> str:
+    """
+    SELECT computing every column's one-day return in a single ordered scan:
+    one shared window, and each LAG evaluated once in the inner query.
+    With dates_table (date, prev_date), only those dates are returned and only
+    they and their preceding rows are read, which seeds each LAG.
+    """
     stock_columns = con.STOCK_COLUMNS
+    date_filter = ""
+    if dates_table:
+        source_table = f"""(
+            SELECT * FROM {source_table}
+            WHERE date IN (SELECT date FROM {dates_table} UNION SELECT prev_date FROM {dates_table})
+        )"""
+        date_filter = f"WHERE date IN (SELECT date FROM {dates_table})"
+    lags = ", ".join(f"{stock}, LAG({stock}, 1) OVER w AS prev_{stock}" for stock in stock_columns)
+    returns = ", ".join(
+        f"(({stock} - prev_{stock}) / NULLIF(prev_{stock}, 0) * 100)::FLOAT AS {stock}"
+        for stock in stock_columns
+    )
+    return f"""
+        SELECT date, {returns}
+        FROM (
+            SELECT date, {lags}
+            FROM {source_table}
+            WINDOW w AS (ORDER BY date)
+        )
+        {date_filter}
+        ORDER BY date
+    """
+
+def record_state(con: DBContext, table_name: str):
+    """Remember which price_wide build table_name was computed from"""
+    source_state = table_state(con, "price_wide")
+    if source_state is None:
+        return
+    con.execute(f"CREATE TABLE IF NOT EXISTS {STATE_TABLE}")
+    con.execute(f"""
+        INSERT OR REPLACE INTO returns_state
+        VALUES ('{table_name}', {source_state[0]}, {source_state[1]}, current_timestamp)
+    """)
+
+def returns_state(con: DBContext, table_name: str):
+    """(source_batch_id, source_generation) of a returns table, or None if it was never computed"""
+    exists = con.con.execute(f"""
+        SELECT COUNT(*) FROM duckdb_tables() WHERE table_name IN ('{table_name}', 'returns_state')
+    """).fetchone()[0] == 2
+    if not exists:
+        return None
+    return con.con.execute(f"""
+        SELECT source_batch_id, source_generation FROM returns_state WHERE table_name = '{table_name}'
+    """).fetchone()
+
+def append(con: DBContext, table_name: str = "stock_returns") -> int:
+    """
+    Recompute only the returns that changed since table_name was last computed:
+    dates after its current max(date), dates price_wide rewrote since then
+    (revised prices), and the date following each revised one, whose return
+    used the old price. Returns the number of dates rewritten.
+    """
+    watermark = returns_state(con, table_name)[0]
+    max_date = con.con.execute(f"SELECT MAX(date) FROM {table_name}").fetchone()[0] or "0001-01-01"
+
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE returns_delta_dates AS
+        WITH ordered AS (
+            SELECT date, LAG(date) OVER (ORDER BY date) AS prev_date, LEAD(date) OVER (ORDER BY date) AS next_date
+            FROM price_wide
+        ),
+        changed AS (
+            SELECT date FROM wide_table_changes WHERE table_name = 'price_wide' AND batch_id > {watermark}
+            UNION
+            SELECT date FROM price_wide WHERE date > '{max_date}'
+        ),
+        affected AS (
+            SELECT date FROM changed
+            UNION
+            SELECT o.next_date FROM ordered o JOIN changed c USING (date) WHERE o.next_date IS NOT NULL
+        )
+        SELECT o.date, o.prev_date FROM ordered o JOIN affected a USING (date)
+    """)
+    delta = con.con.execute("SELECT COUNT(*), MIN(date), MAX(date) FROM returns_delta_dates").fetchone()
+    logger.info(f"{delta[0]} return dates to refresh ({delta[1]} to {delta[2]}) since price_wide batch {watermark}, last date {max_date}")
+
+    con.execute("BEGIN TRANSACTION")
+    if delta[0]:
+        con.execute(f"DELETE FROM {table_name} WHERE date IN (SELECT date FROM returns_delta_dates)")
+        con.execute(f"INSERT INTO {table_name} BY NAME {returns_sql(con, dates_table='returns_delta_dates')}")
+    record_state(con, table_name)
+    con.execute("COMMIT")
+    con.execute("DROP TABLE returns_delta_dates")
+    return delta[0]
+
+def calculate_returns_window(con: DBContext, table_name: str = "stock_returns"):
+    """Write all returns straight into table_name with one CREATE TABLE AS"""
+    drop_other_kind(con, table_name)
+    con.execute(f"CREATE OR REPLACE TABLE {table_name} AS {returns_sql(con)}")
+    logger.info(f"Calculated returns for {len(con.STOCK_COLUMNS)} columns into {table_name}")
+
+@staged("returns")
+def calculate_returns(con: DBContext, batch_size=20, engine: str = "batched", table_name: str = "stock_returns",
+                      incremental: bool = False, adaptive: bool = False):
+    """
+    Calculate returns for all stocks using batch processing similar to transform.py
+    (adaptive=True sizes each batch from the peak memory of the previous ones)
+
+    engine="window" instead computes every column in a single pass (see returns_sql).
+    incremental=True only recomputes new and revised dates (see append); it falls
+    back to a full computation when price_wide was rebuilt since the last run.
+    """
+    if incremental:
+        state = returns_state(con, table_name)
+        source_state = table_state(con, "price_wide")
+        if state and source_state and state[1] == source_state[1]:
+            append(con, table_name=table_name)
+            return
+        logger.info(f"{table_name} was not computed from the current price_wide build, recomputing all returns")
+        if engine == "batched":
+            create_table(con, table_name=table_name)
+
+    if engine == "window":
+        calculate_returns_window(con, table_name=table_name)
+        record_state(con, table_name)
+        return
+
+    batches = AdaptiveBatcher(con.STOCK_COLUMNS, initial_size=batch_size,
+                              target_mb=con.batch_target_mb() if adaptive else None)
+    dates = con.con.execute("SELECT COUNT(*) FROM price_wide").fetchone()[0]
     
     try:
         
-        total_stocks = len(stock_columns)
-         
         # Process stocks in batches
-        for i in range(0, total_stocks, batch_size):
-            batch_end = min(i + batch_size, total_stocks)
-            batch_ids = con.STOCK_COLUMNS[i:batch_end]
+        for i, batch_ids in enumerate(batches):
             logger.info(f"Processing batch starting with column {batch_ids[0]}")
             
             # Create return calculation expressions for this batch
@@ -41,40 +175,64 @@ def calculate_returns(con: DBContext, batch_size=20):
                 """)
             
             if i == 0:
-                con.execute("""
-                    INSERT OR IGNORE INTO stock_returns (date)
+                con.execute(f"""
+                    INSERT OR IGNORE INTO {table_name} (date)
                     SELECT date FROM price_wide
                 """)
 
-            # Begin transaction for this batch
-            con.execute("BEGIN TRANSACTION")
-                        
-            # Update stock_returns with calculated returns for this batch
-            update_sql = f"""
-                UPDATE stock_returns sr
-                SET {', '.join(f'{stock} = batch_returns.{stock}' for stock in batch_ids)}
-                FROM (
-                    SELECT 
-                        pw.date,
-                        {', '.join(return_exprs)}
-                    FROM price_wide pw
-                    ORDER BY pw.date
-                ) AS batch_returns
-                WHERE sr.date = batch_returns.date
-            """
-            logger.info(update_sql)
-            
-            con.execute(update_sql)
-            
-            # Commit transaction
-            con.execute("COMMIT")
+            with batches.track(batch_ids) as stats:
+                # Begin transaction for this batch
+                con.execute("BEGIN TRANSACTION")
+                            
+                # Update stock_returns with calculated returns for this batch
+                update_sql = f"""
+                    UPDATE {table_name} sr
+                    SET {', '.join(f'{stock} = batch_returns.{stock}' for stock in batch_ids)}
+                    FROM (
+                        SELECT 
+                            pw.date,
+                            {', '.join(return_exprs)}
+                        FROM price_wide pw
+                        ORDER BY pw.date
+                    ) AS batch_returns
+                    WHERE sr.date = batch_returns.date
+                """
+                logger.info(update_sql)
+                
+                con.execute(update_sql)
+                
+                # Commit transaction
+                con.execute("COMMIT")
+                stats["rows"] = dates * len(batch_ids)
             
-            # Log memory usage after each batch
             logger.info(f"Completed batch {batch_ids[0]}-{batch_ids[-1]}")
+        logger.info(f"Calculated returns for {len(con.STOCK_COLUMNS)} columns in {len(batches.history)} batches, "
+                    f"peak RSS {batches.peak_mb:.0f} MB")
+        record_state(con, table_name)
     except Exception as e:
         logger.error(f"Error calculating returns: {e}")
         raise 
 
+def compare_engines(con: DBContext, batch_size=20) -> dict:
+    """Time the batched UPDATE and single-pass window engines and count differing rows"""
+    timings = {}
+    for engine in ("batched", "window"):
+        start = time.perf_counter()
+        if engine == "batched":
+            create_table(con, table_name=f"stock_returns_{engine}")
+        calculate_returns(con, batch_size=batch_size, engine=engine, table_name=f"stock_returns_{engine}")
+        timings[engine] = time.perf_counter() - start
+
+    mismatched = mismatched_rows(con, "stock_returns_batched", "stock_returns_window")
+    for engine in timings:
+        con.execute(f"DROP TABLE stock_returns_{engine}")
+
+    logger.info(
+        f"returns: batched {timings['batched']:.2f}s, window {timings['window']:.2f}s "
+        f"({timings['batched'] / max(timings['window'], 1e-9):.1f}x), {mismatched} mismatched rows"
+    )
+    return {"mismatched_rows": mismatched, **timings}
+
 if __name__ == "__main__":
     
     logging.basicConfig(
@@ -88,9 +246,21 @@ if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description='Analyze stock returns')
     parser.add_argument('--output', default="results", help='Output directory for results')
+    parser.add_argument('--engine', choices=['batched', 'window'], default='batched',
+                        help='one UPDATE per batch of columns, or a single window pass')
+    parser.add_argument('--compare', action='store_true',
+                        help='time both engines and check they produce the same returns')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only compute returns for new and revised dates of price_wide')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='size each batch of the batched engine from the peak memory of the previous ones')
     args = parser.parse_args()
     
-    with DBContext(profile=True) as con:
-        create_table(con)
-        calculate_returns(con)
-        con.verify('stock_returns')
\ No newline at end of file
+    with DBContext(profile=True, metrics_path="logs/metrics.jsonl", metrics_table="pipeline_metrics") as con:
+        if args.compare:
+            compare_engines(con)
+        else:
+            if not args.incremental:
+                create_table(con)
+            calculate_returns(con, engine=args.engine, incremental=args.incremental, adaptive=args.adaptive)
+            con.verify('stock_returns')
\ No newline at end of file
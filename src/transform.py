@@ -1,82 +1,377 @@
 import argparse
 import logging
-from src.config import DBContext
+import time
+from src.config import AdaptiveBatcher, DBContext, drop_other_kind, staged, stock_columns, timed_growth
+from src.verify import last_changed_range, verify_all
 
 logger = logging.getLogger(__name__)
 
+FIELDS = ("price", "trade_volume")
+
+# ingest batch absorbed by each wide table; generation changes on every full rebuild
+STATE_TABLE = """
+    wide_table_state
+        (table_name VARCHAR PRIMARY KEY,
+        batch_id INTEGER,
+        generation INTEGER,
+        updated_at TIMESTAMP
+        )
+"""
+
+# dates rewritten by incremental runs, so downstream stages can refresh just those
+CHANGES_TABLE = """
+    wide_table_changes
+        (table_name VARCHAR,
+        date DATE,
+        batch_id INTEGER
+        )
+"""
+
 def create_wide_tables(con: DBContext, table: str) -> None:
     # Create prices and trade_volume table for local testing
     columns = ["date DATE PRIMARY KEY"]
     data_type = "INTEGER"
-    if table == "price":
+    if table.startswith("price"):
         data_type = "FLOAT"
-    
-    for stock in DBContext.STOCK_COLUMNS:
+
+    for stock in con.STOCK_COLUMNS:
         columns.append(f"{stock} {data_type}")    
     try:
         str_columns = ', '.join(columns)
+        drop_other_kind(con, table)
         con.execute(f"CREATE OR REPLACE TABLE {table} ({str_columns})")
         logger.info(f"Successfully created {table} table")
     except Exception as e:
         logger.error(f"Failed to create tables: {e}")
         raise        
 
-def main(con: DBContext, *, field: str, source_table="stocks.raw", batch_size: int = 20, local: bool = True):
-    """ 
+def pivot(con: DBContext, *, tables: dict[str, str], source_table="stocks.raw", dates_table: str = None):
+    """
+    Fill the wide tables in a single PIVOT pass over source_table, instead of
+    one UPDATE of the whole wide table per batch of ids.
+
+    With several fields, one PIVOT computes every field per symbol into a
+    temp table, which is then split into the per-field wide tables.
+    With dates_table, only those dates are pivoted and upserted.
+    """
+    symbols = ", ".join(f"'stk_{id}'" for id in con.SYMBOLS)
+    fields = list(tables)
+    insert = "INSERT OR REPLACE INTO" if dates_table else "INSERT INTO"
+    date_filter = f"AND date IN (SELECT date FROM {dates_table})" if dates_table else ""
+    target = f"{insert} {tables[fields[0]]} BY NAME" if len(fields) == 1 else "CREATE OR REPLACE TEMP TABLE wide_pivot AS"
+    pivot_sql = f"""
+        {target}
+        PIVOT (
+            SELECT date, 'stk_' || id AS symbol, {', '.join(fields)}
+            FROM {source_table}
+            WHERE id IN ({','.join(str(id) for id in con.SYMBOLS)})
+            {date_filter}
+        )
+        ON symbol IN ({symbols})
+        USING {', '.join(f'MAX({field}) AS {field}' if len(fields) > 1 else f'MAX({field})' for field in fields)}
+        GROUP BY date
+        ORDER BY date
+    """
+    logger.info(pivot_sql)
+    con.execute(pivot_sql)
+    if con.profile:
+        logger.info(f"Pivot scanned {con.rows_scanned(source_table):,} rows of {source_table}")
+
+    if len(fields) > 1:
+        for field, table_name in tables.items():
+            con.execute(f"""
+                {insert} {table_name}
+                SELECT date, {', '.join(f'{stock}_{field} AS {stock}' for stock in con.STOCK_COLUMNS)}
+                FROM wide_pivot
+                ORDER BY date
+            """)
+        con.execute("DROP TABLE wide_pivot")
+
+def has_manifest(con: DBContext) -> bool:
+    return con.con.execute("""
+        SELECT COUNT(*) FROM duckdb_tables() WHERE database_name = 'stocks' AND table_name = 'ingest_manifest'
+    """).fetchone()[0] > 0
+
+def ingest_batch(con: DBContext) -> int:
+    """Latest ingest batch recorded in stocks.ingest_manifest, 0 without a manifest"""
+    if not has_manifest(con):
+        return 0
+    return con.con.execute("SELECT COALESCE(MAX(batch_id), 0) FROM stocks.ingest_manifest").fetchone()[0]
+
+def record_state(con: DBContext, tables: dict[str, str], batch_id: int, rebuilt: bool):
+    con.execute(f"CREATE TABLE IF NOT EXISTS {STATE_TABLE}")
+    con.execute(f"CREATE TABLE IF NOT EXISTS {CHANGES_TABLE}")
+    for table_name in tables.values():
+        generation = f"""COALESCE((SELECT generation FROM wide_table_state WHERE table_name = '{table_name}'), 0)"""
+        if rebuilt:
+            generation += " + 1"
+            con.execute(f"DELETE FROM wide_table_changes WHERE table_name = '{table_name}'")
+        con.execute(f"""
+            INSERT OR REPLACE INTO wide_table_state
+            VALUES ('{table_name}', {batch_id}, {generation}, current_timestamp)
+        """)
+
+def table_state(con: DBContext, table_name: str):
+    """(batch_id, generation) of a wide table, or None if it was never built"""
+    exists = con.con.execute(f"""
+        SELECT COUNT(*) FROM duckdb_tables() WHERE table_name IN ('{table_name}', 'wide_table_state')
+    """).fetchone()[0] == 2
+    if not exists:
+        return None
+    return con.con.execute(f"""
+        SELECT batch_id, generation FROM wide_table_state WHERE table_name = '{table_name}'
+    """).fetchone()
+
+def wide_columns(con: DBContext, table_name: str) -> list[str]:
+    """stk_<id> columns of a wide table, in table order"""
+    return stock_columns(con.con, table_name)
+
+def append(con: DBContext, *, tables: dict[str, str], source_table="stocks.raw") -> int:
+    """
+    Upsert only the dates that changed since the wide tables were last built:
+    dates after their current max(date), plus dates touched by files from a
+    later ingest batch (late corrections). Returns the number of dates rewritten.
+    """
+    watermark = min(table_state(con, table_name)[0] for table_name in tables.values())
+    max_date = min(con.con.execute(f"SELECT MAX(date) FROM {table_name}").fetchone()[0] or "0001-01-01"
+                   for table_name in tables.values())
+    batch_id = ingest_batch(con)
+    # resolve the re-ingested files first, so the source is filtered without a join
+    file_ids = [row[0] for row in con.con.execute(
+        f"SELECT file_id FROM stocks.ingest_manifest WHERE batch_id > {watermark}").fetchall()]
+    corrected = f" OR r.file_id IN ({', '.join(str(file_id) for file_id in file_ids)})" if file_ids else ""
+
+    con.execute(f"""
+        CREATE OR REPLACE TEMP TABLE wide_delta_dates AS
+        SELECT DISTINCT r.date
+        FROM {source_table} r
+        WHERE r.date > '{max_date}'{corrected}
+    """)
+    delta = con.con.execute("SELECT COUNT(*), MIN(date), MAX(date) FROM wide_delta_dates").fetchone()
+    logger.info(f"{delta[0]} dates to refresh ({delta[1]} to {delta[2]}) since ingest batch {watermark}, last date {max_date}")
+
+    con.execute("BEGIN TRANSACTION")
+    if delta[0]:
+        pivot(con, tables=tables, source_table=source_table, dates_table="wide_delta_dates")
+    record_state(con, tables, batch_id, rebuilt=False)
+    for table_name in tables.values():
+        con.execute(f"""
+            INSERT INTO wide_table_changes
+            SELECT '{table_name}', date, {batch_id} FROM wide_delta_dates
+        """)
+    con.execute("COMMIT")
+    con.execute("DROP TABLE wide_delta_dates")
+    return delta[0]
+
+@staged("transform")
+def main(con: DBContext, *, field: str, source_table="stocks.raw", batch_size: int = 20, local: bool = True,
+         engine: str = "batched", table_suffix: str = "", incremental: bool = False, adaptive: bool = False):
     """
-    total_stocks = len(con.SYMBOLS)
-    table_name = f"{field}_wide"
-        
+    Build {field}_wide (date x stk_<id>) from the long source table.
+
+    Args:
+        con: DBContext
+        field: price, trade_volume or all (both wide tables from the same scans)
+        source_table: long (id, date, price, trade_volume) table
+        batch_size: ids per UPDATE pass for the batched engine (the first
+            pass when adaptive)
+        local: (re)create the wide table first
+        engine: "batched" (INSERT dates, then one UPDATE per batch of ids)
+            or "pivot" (single PIVOT pass)
+        table_suffix: appended to {field}_wide, to build into scratch tables
+        incremental: upsert only new / corrected dates into existing wide
+            tables (PIVOT over the delta); falls back to a full build when a
+            table has not been built yet or the symbol set has changed
+        adaptive: size each batch of the batched engine from the peak memory
+            of the previous ones, targeting con.batch_target_mb()
+    """
+    fields = FIELDS if field == "all" else (field,)
+    tables = {f: f"{f}_wide{table_suffix}" for f in fields}
+
+    if incremental and all(table_state(con, table_name) for table_name in tables.values()):
+        if all(wide_columns(con, table_name) == con.STOCK_COLUMNS for table_name in tables.values()):
+            append(con, tables=tables, source_table=source_table)
+            return
+        logger.info(f"Symbol set changed since {', '.join(tables.values())} were built, rebuilding")
+
+    batch_id = ingest_batch(con)
+    # build state refers to ingest batches, so it is only kept for manifest-tracked sources
+    track_state = not table_suffix and has_manifest(con)
     if local:
-        create_wide_tables(con, table=f"{table_name}")
-    
-    for i in range(0, total_stocks, batch_size):
-        batch_end = min(i + batch_size, total_stocks)
-        batch_ids = con.SYMBOLS[i:batch_end]
-        logger.info(f"Processing batch starting with ID {batch_ids[0]}")
-        
-        # Create pivot query for this batch
-        pivot_columns = []
+        for table_name in tables.values():
+            create_wide_tables(con, table=f"{table_name}")
+
+    if engine == "pivot":
+        pivot(con, tables=tables, source_table=source_table)
+        if track_state:
+            record_state(con, tables, batch_id, rebuilt=True)
+        return
+
+    id_list = ','.join(str(id) for id in con.SYMBOLS)
+    batches = AdaptiveBatcher(con.SYMBOLS, initial_size=batch_size,
+                              target_mb=con.batch_target_mb() if adaptive else None)
+
+    for i, batch_ids in enumerate(batches):
+        with batches.track(batch_ids) as stats:
+            process_batch(con, batch_ids, fields=fields, tables=tables, source_table=source_table,
+                          id_list=id_list if i == 0 else None, stats=stats)
+
+    logger.info(f"Processed {len(con.SYMBOLS)} stocks in {len(batches.history)} batches, "
+                f"peak RSS {batches.peak_mb:.0f} MB")
+    if track_state:
+        record_state(con, tables, batch_id, rebuilt=True)
+
+def process_batch(con: DBContext, batch_ids: list[int], *, fields, tables: dict[str, str], source_table: str,
+                  id_list: str = None, stats: dict = None):
+    """
+    Fill the columns of batch_ids in every wide table with one UPDATE each.
+    With id_list (first batch only), first insert every date of those ids.
+    stats["rows"] holds the rows scanned when profiling, else the cells written.
+    """
+    logger.info(f"Processing batch starting with ID {batch_ids[0]}")
+
+    # Create pivot query for this batch, one column per field and id
+    pivot_columns = []
+    for f in fields:
         for stock_id in batch_ids:
-            pivot_columns.append(f"MAX(CASE WHEN id = {stock_id} THEN {field} END) AS stk_{stock_id}")
-        
-        pivot_sql = ", ".join(pivot_columns)
+            pivot_columns.append(f"MAX(CASE WHEN id = {stock_id} THEN {f} END) AS {f}_stk_{stock_id}")
+
+    pivot_sql = ", ".join(pivot_columns)
 
-        if i == 0:
+    if id_list:
+        for table_name in tables.values():
             con.execute(f"""
                     INSERT OR IGNORE INTO {table_name} (date)
-                    SELECT date FROM {source_table} 
-                    WHERE id = 1 
+                    SELECT DISTINCT date FROM {source_table}
+                    WHERE id IN ({id_list})
                     ORDER BY date
             """)
-        
+
+    batch_pivot_sql = f"""
+        SELECT 
+            date,
+            {pivot_sql}
+        FROM {source_table}
+        WHERE id BETWEEN {min(batch_ids)} AND {max(batch_ids)}
+          AND id IN ({','.join(str(id) for id in batch_ids)})
+        GROUP BY date
+        ORDER BY date
+    """
+    con.execute("BEGIN TRANSACTION")
+    if len(fields) > 1:
+        # scan the source once for every field, then update each wide table from the result
+        con.execute(f"CREATE OR REPLACE TEMP TABLE batch_pivot AS {batch_pivot_sql}")
+        if con.profile:
+            rows = con.rows_scanned(source_table)
+            logger.info(f"Batch {batch_ids[0]}-{batch_ids[-1]} scanned {rows:,} rows of {source_table}")
+            if stats is not None:
+                stats["rows"] = rows
+        batch_source = "batch_pivot"
+    else:
+        batch_source = f"({batch_pivot_sql}) AS batch_pivot"
+
+    for f, table_name in tables.items():
         update_sql = f"""
-        UPDATE {field}_wide
-        SET {', '.join(f'stk_{id} = batch_pivot.stk_{id}' for id in batch_ids)}
-        FROM (
-            SELECT 
-                date,
-                {pivot_sql}
-            FROM {source_table}
-            WHERE id IN ({','.join(str(id) for id in batch_ids)})
-            GROUP BY date
-            ORDER BY date
-        ) AS batch_pivot
-        WHERE {field}_wide.date = batch_pivot.date
+        UPDATE {table_name}
+        SET {', '.join(f'stk_{id} = batch_pivot.{f}_stk_{id}' for id in batch_ids)}
+        FROM {batch_source}
+        WHERE {table_name}.date = batch_pivot.date
         """
         logger.info(update_sql)
-        con.execute("BEGIN TRANSACTION")
-        con.execute(update_sql)
-        con.execute("COMMIT")
-        
-        logger.info(f"Processed stocks {batch_ids[0]}-{batch_end}")
- 
+        updated = con.execute(update_sql)[0][0]
+        if con.profile and len(fields) == 1:
+            rows = con.rows_scanned(source_table)
+            logger.info(f"Batch {batch_ids[0]}-{batch_ids[-1]} scanned {rows:,} rows of {source_table}")
+            if stats is not None:
+                stats["rows"] = rows
+    if stats is not None and stats["rows"] is None:
+        stats["rows"] = updated * len(batch_ids)
+    if len(fields) > 1:
+        con.execute("DROP TABLE batch_pivot")
+    con.execute("COMMIT")
+
+    logger.info(f"Processed stocks {batch_ids[0]}-{batch_ids[-1]}")
+
+def mismatched_rows(con: DBContext, table_a: str, table_b: str) -> int:
+    """Rows present in one table but not the other (NULLs compare equal)"""
+    return con.con.execute(f"""
+        SELECT COUNT(*) FROM (
+            (SELECT * FROM {table_a} EXCEPT ALL SELECT * FROM {table_b})
+            UNION ALL
+            (SELECT * FROM {table_b} EXCEPT ALL SELECT * FROM {table_a})
+        )
+    """).fetchone()[0]
+
+def compare_engines(con: DBContext, *, field: str, source_table="stocks.raw", batch_size: int = 20) -> dict:
+    """
+    Build {field}_wide with both engines into scratch tables, time them and
+    count rows that differ between the two results.
+    """
+    timings = {}
+    for engine in ("batched", "pivot"):
+        start = time.perf_counter()
+        main(con, field=field, source_table=source_table, batch_size=batch_size,
+             engine=engine, table_suffix=f"_{engine}")
+        timings[engine] = time.perf_counter() - start
+
+    mismatched = mismatched_rows(con, f"{field}_wide_batched", f"{field}_wide_pivot")
+    for engine in timings:
+        con.execute(f"DROP TABLE {field}_wide_{engine}")
+
+    logger.info(
+        f"{field}: batched {timings['batched']:.2f}s, pivot {timings['pivot']:.2f}s "
+        f"({timings['batched'] / max(timings['pivot'], 1e-9):.1f}x), {mismatched} mismatched rows"
+    )
+    return {"field": field, "mismatched_rows": mismatched, **timings}
+
+def compare_all(con: DBContext, *, source_table="stocks.raw", batch_size: int = 20, engine: str = "pivot") -> dict:
+    """
+    Time and measure the RSS growth (see timed_growth) of building both wide
+    tables from one scan (field="all") against two sequential single-field
+    runs, and check that both produce the same tables.
+    """
+    def sequential():
+        for field in FIELDS:
+            main(con, field=field, source_table=source_table, batch_size=batch_size,
+                 engine=engine, table_suffix="_sequential")
+
+    runs = {
+        "sequential": timed_growth(sequential),
+        "all": timed_growth(lambda: main(con, field="all", source_table=source_table, batch_size=batch_size,
+                                         engine=engine, table_suffix="_all")),
+    }
+
+    mismatched = sum(mismatched_rows(con, f"{field}_wide_sequential", f"{field}_wide_all") for field in FIELDS)
+    for field in FIELDS:
+        con.execute(f"DROP TABLE {field}_wide_sequential")
+        con.execute(f"DROP TABLE {field}_wide_all")
+
+    (seq_time, seq_mb), (all_time, all_mb) = runs["sequential"], runs["all"]
+    logger.info(
+        f"{engine}: sequential {seq_time:.2f}s / +{seq_mb:.0f} MB, "
+        f"all {all_time:.2f}s / +{all_mb:.0f} MB; saved {seq_time - all_time:.2f}s "
+        f"and {seq_mb - all_mb:.0f} MB of RSS growth, {mismatched} mismatched rows"
+    )
+    return {
+        "engine": engine, "mismatched_rows": mismatched,
+        "sequential_seconds": seq_time, "all_seconds": all_time,
+        "sequential_growth_mb": seq_mb, "all_growth_mb": all_mb,
+    }
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Process stock data')
-    parser.add_argument('--table', choices=['price', 'trade_volume'], required=True, 
-                        help='Type of data to process: price or volume')
+    parser.add_argument('--table', choices=['price', 'trade_volume', 'all'], required=True,
+                        help='Type of data to process: price, volume or all (both from one scan)')
+    parser.add_argument('--engine', choices=['batched', 'pivot'], default='batched',
+                        help='one UPDATE per batch of ids, or a single PIVOT pass')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only pivot dates that are new or were re-ingested since the last run')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='size each batch of the batched engine from the peak memory of the previous ones')
+    parser.add_argument('--compare', action='store_true',
+                        help='time both engines (or, with --table all, one scan vs two runs) and check results match')
     args = parser.parse_args()
- 
+
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -85,11 +380,20 @@ if __name__ == '__main__':
             logging.StreamHandler()
         ]
     )
-    
+
     logger.info(f"Starting processing for {args.table} data")
-    
-    with DBContext(profile=True) as conn:
-        main(conn, field=args.table) 
-        conn.verify(table=f"{args.table}_wide")
+
+    with DBContext(profile=True, metrics_path="logs/metrics.jsonl", metrics_table="pipeline_metrics") as conn:
+        if args.compare and args.table == "all":
+            compare_all(conn, engine=args.engine)
+        elif args.compare:
+            compare_engines(conn, field=args.table)
+        else:
+            main(conn, field=args.table, engine=args.engine, incremental=args.incremental, adaptive=args.adaptive) 
+            tables = [f"{field}_wide" for field in (FIELDS if args.table == "all" else (args.table,))]
+            # after an incremental run, only the rewritten dates need checking
+            changed = [last_changed_range(conn, table) for table in tables] if args.incremental else [None]
+            start = None if None in changed else min(dates[0] for dates in changed)
+            # one call, so stocks.raw is scanned once for every table
+            verify_all(conn, tables, start=start)
     logger.info(f"Completed processing for {args.table} data")
-    
\ No newline at end of file
@@ -0,0 +1,167 @@
+import argparse
+import logging
+import time
+from src.config import DBContext
+
+logger = logging.getLogger(__name__)
+
+WIDE_TABLES = ("price_wide", "trade_volume_wide", "stock_returns")
+
+# rows holding a value no valid table can contain; LEAST/GREATEST skip NULLs and NaN sorts last
+OUT_OF_RANGE = {
+    "price": "LEAST(*COLUMNS('^stk_')) <= 0 OR isfinite(GREATEST(*COLUMNS('^stk_'))) = false",
+    "trade_volume": "LEAST(*COLUMNS('^stk_')) < 0",
+    "returns": "LEAST(*COLUMNS('^stk_')) <= -100 OR isfinite(GREATEST(*COLUMNS('^stk_'))) = false",
+}
+
+
+def table_kind(table: str) -> str:
+    if table.startswith("price"):
+        return "price"
+    if table.startswith("trade_volume"):
+        return "trade_volume"
+    return "returns"
+
+def date_filter(start=None, end=None, column: str = "date") -> list[str]:
+    filters = []
+    if start is not None:
+        filters.append(f"{column} >= '{start}'")
+    if end is not None:
+        filters.append(f"{column} <= '{end}'")
+    return filters
+
+def last_changed_range(con: DBContext, table_name: str = "price_wide"):
+    """(first, last) date rewritten by the latest incremental run of a wide table, or None"""
+    exists = con.con.execute("SELECT COUNT(*) FROM duckdb_tables() WHERE table_name = 'wide_table_changes'").fetchone()[0]
+    if not exists:
+        return None
+    first, last = con.con.execute(f"""
+        SELECT MIN(date), MAX(date) FROM wide_table_changes
+        WHERE table_name = '{table_name}'
+          AND batch_id = (SELECT MAX(batch_id) FROM wide_table_changes WHERE table_name = '{table_name}')
+    """).fetchone()
+    return (first, last) if first is not None else None
+
+def raw_counts(con: DBContext, start=None, end=None, source_table: str = "stocks.raw") -> dict:
+    """
+    Dates and non-NULL (id, date) cells per field in source_table for the
+    known symbols, from one scan; what the wide tables should hold.
+    """
+    filters = [f"id IN ({','.join(str(id) for id in con.SYMBOLS)})"] + date_filter(start, end)
+    dates, price, trade_volume = con.con.execute(f"""
+        SELECT COUNT(DISTINCT date), COUNT(price), COUNT(trade_volume)
+        FROM (
+            SELECT date, MAX(price) AS price, MAX(trade_volume) AS trade_volume
+            FROM {source_table}
+            WHERE {' AND '.join(filters)}
+            GROUP BY id, date
+        )
+    """).fetchone()
+    return {"dates": dates, "price": price, "trade_volume": trade_volume}
+
+def verify_table(con: DBContext, table: str, *, start=None, end=None, expected: dict = None) -> dict:
+    """
+    Check one wide table in a single scan: row count, duplicate dates,
+    non-NULL count per column and rows with out-of-range values. The first
+    date of a returns table has no previous price and is skipped.
+
+    Args:
+        start, end: only verify this inclusive date range (e.g. the dates an
+            incremental run wrote)
+        expected: {"dates": n, "cells": n} to compare against, e.g. from
+            raw_counts, or None to skip the parity check
+    """
+    kind = table_kind(table)
+    filters = date_filter(start, end)
+    if kind == "returns":
+        filters.append(f"date > (SELECT MIN(date) FROM {table})")
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    result = con.con.execute(f"""
+        SELECT COUNT(*), COUNT(DISTINCT date), COUNT_IF({OUT_OF_RANGE[kind]}), COUNT(COLUMNS('^stk_'))
+        FROM {table}
+        {where}
+    """)
+    row = result.fetchone()
+    columns = [description[0] for description in result.description][3:]
+    total_rows, dates, out_of_range = row[:3]
+    counts = dict(zip(columns, row[3:]))
+
+    report = {
+        "table": table,
+        "rows": total_rows,
+        "duplicate_dates": total_rows - dates,
+        "out_of_range_rows": out_of_range,
+        "all_null_columns": [column for column, count in counts.items() if count == 0 and total_rows],
+        "null_cells": sum(total_rows - count for count in counts.values()),
+        "cells": sum(counts.values()),
+    }
+    issues = []
+    if report["duplicate_dates"]:
+        issues.append(f"{report['duplicate_dates']} duplicate dates")
+    if out_of_range:
+        issues.append(f"{out_of_range} rows with out-of-range {kind} values")
+    if report["all_null_columns"]:
+        issues.append(f"{len(report['all_null_columns'])} columns with all NULL values: {report['all_null_columns'][:10]}")
+    if expected is not None:
+        if total_rows != expected["dates"]:
+            issues.append(f"{total_rows} rows, expected {expected['dates']} dates")
+        if "cells" in expected and report["cells"] != expected["cells"]:
+            issues.append(f"{report['cells']} non-NULL values, expected {expected['cells']}")
+    report["issues"] = issues
+
+    logger.info(f"Verification: {table} has {total_rows} rows, {report['null_cells']} NULL values")
+    for issue in issues:
+        logger.error(f"{table}: {issue}")
+    return report
+
+def verify_all(con: DBContext, tables=WIDE_TABLES, *, start=None, end=None, source_table: str = "stocks.raw") -> dict:
+    """
+    Verify the wide tables with one scan each, plus one scan of source_table
+    for row-count parity: price_wide and trade_volume_wide should hold every
+    raw date and (id, date) value, stock_returns one row per price_wide date.
+    """
+    begin = time.perf_counter()
+    raw = None
+    if any(table_kind(table) != "returns" for table in tables):
+        raw = raw_counts(con, start, end, source_table=source_table)
+    reports = {}
+    for table in tables:
+        kind = table_kind(table)
+        if kind == "returns":
+            price_filters = date_filter(start, end)
+            price_filters.append("date > (SELECT MIN(date) FROM price_wide)")
+            dates = con.con.execute(f"SELECT COUNT(*) FROM price_wide WHERE {' AND '.join(price_filters)}").fetchone()[0]
+            expected = {"dates": dates}
+        else:
+            expected = {"dates": raw["dates"], "cells": raw[kind]}
+        reports[table] = verify_table(con, table, start=start, end=end, expected=expected)
+    logger.info(f"Verified {len(reports)} tables in {time.perf_counter() - begin:.2f}s, "
+                f"{sum(len(report['issues']) for report in reports.values())} issues")
+    return reports
+
+if __name__ == "__main__":
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler("logs/verify.log"),
+            logging.StreamHandler()
+        ]
+    )
+
+    parser = argparse.ArgumentParser(description='Verify the wide tables against stocks.raw')
+    parser.add_argument('--tables', nargs='+', default=list(WIDE_TABLES), help='wide tables to verify')
+    parser.add_argument('--start', default=None, help='first date to verify (YYYY-MM-DD)')
+    parser.add_argument('--end', default=None, help='last date to verify (YYYY-MM-DD)')
+    parser.add_argument('--changed', action='store_true',
+                        help='only verify the dates rewritten by the latest incremental transform')
+    args = parser.parse_args()
+
+    with DBContext() as con:
+        start, end = args.start, args.end
+        if args.changed:
+            start, end = last_changed_range(con) or (start, end)
+        reports = verify_all(con, args.tables, start=start, end=end)
+    if any(report["issues"] for report in reports.values()):
+        raise SystemExit(1)
@@ -0,0 +1,62 @@
+import logging
+from src.config import DBContext
+from src import ingest, transform
+import src.analytics as main
+
+root_logger = logging.getLogger()
+for handler in root_logger.handlers[:]:
+    root_logger.removeHandler(handler)
+    
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/analytics_test.log"),
+        logging.StreamHandler()
+    ]
+)
+
+def mismatches(conn, expected: str, table: str, stock: str) -> int:
+    """Dates where table.stock differs from the reference query (NULLs must match, values within 1e-5 relative)"""
+    return conn.con.execute(f"""
+        SELECT COUNT(*)
+        FROM ({expected}) e JOIN {table} a USING (date)
+        WHERE (e.value IS NULL) != (a.{stock} IS NULL)
+           OR ABS(e.value - a.{stock}) > 1e-5 * GREATEST(ABS(e.value), 1)
+    """).fetchone()[0]
+
+def test_analytics(tmp_path):
+    with  DBContext(db_path=str(tmp_path / "stocks.duckdb"), profile=True, memory_limit=1) as conn:
+        ingest.process_file_by_file(conn, input_dir='./data/', mode='bulk', close=False)
+        transform.main(conn, field="all", engine="pivot")
+        main.main(conn, metrics=["log_return", "return_5d", "volatility_21d", "vwap_21d"], group_size=64)
+        rows = conn.con.execute("SELECT COUNT(*) FROM price_wide").fetchone()[0]
+
+        for stock in ("stk_1", conn.STOCK_COLUMNS[-1]):
+            log_return = f"LN({stock} / LAG({stock}) OVER (ORDER BY date))"
+            references = {
+                "stock_log_return": f"SELECT date, {log_return} AS value FROM price_wide",
+                "stock_return_5d": f"SELECT date, ({stock} / LAG({stock}, 5) OVER (ORDER BY date) - 1) * 100 AS value FROM price_wide",
+                # each date against its own 21 log returns, from a self-join on row numbers
+                "stock_volatility_21d": f"""
+                    WITH r AS (
+                        SELECT ROW_NUMBER() OVER (ORDER BY date) AS i, date, {log_return} AS lr FROM price_wide
+                    )
+                    SELECT a.date, CASE WHEN COUNT(b.i) FILTER (WHERE b.i > 1) = 21 THEN STDDEV_SAMP(b.lr) END AS value
+                    FROM r a JOIN r b ON b.i BETWEEN a.i - 20 AND a.i
+                    GROUP BY a.date
+                """,
+                "stock_vwap_21d": f"""
+                    SELECT date, CASE WHEN ROW_NUMBER() OVER w >= 21
+                        THEN SUM(p.{stock}::DOUBLE * v.{stock}) OVER w / SUM(v.{stock}) OVER w END AS value
+                    FROM price_wide p JOIN trade_volume_wide v USING (date)
+                    WINDOW w AS (ORDER BY date ROWS BETWEEN 20 PRECEDING AND CURRENT ROW)
+                """,
+            }
+            for table, expected in references.items():
+                assert conn.con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == rows
+                assert mismatches(conn, expected, table, stock) == 0, table
+
+        volatility = conn.con.execute(f"SELECT COUNT({conn.STOCK_COLUMNS[-1]}) FROM stock_volatility_21d").fetchone()[0]
+        assert 0 < volatility <= rows - 21
@@ -0,0 +1,32 @@
+import json
+import logging
+import src.benchmark as main
+
+root_logger = logging.getLogger()
+for handler in root_logger.handlers[:]:
+    root_logger.removeHandler(handler)
+    
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/benchmark_test.log"),
+        logging.StreamHandler()
+    ]
+)
+
+def test_benchmark(tmp_path):
+    output = tmp_path / "benchmark.json"
+    main.main(["0.002"], cpu_counts=(2,), memory_limits=(1,), batch_sizes=(50, 200), output=str(output),
+              work_dir=str(tmp_path))
+    report = json.loads(output.read_text())
+    assert report["datasets"]["0.002"]["num_stocks"] == 200
+    stages = [(result["stage"], result["engine"]) for result in report["results"]]
+    # the pivot and window engines ignore batch_size and only run with the first one
+    assert stages == [("ingest", "bulk"), ("transform", "batched"), ("transform", "pivot"),
+                      ("returns", "batched"), ("returns", "window"), ("verify", "scan"),
+                      ("ingest", "bulk"), ("transform", "batched"), ("returns", "batched"), ("verify", "scan")]
+    assert [result["batch_size"] for result in report["results"] if result["stage"] in ("transform", "returns")] == \
+        [50, None, 50, None, 200, 200]
+    assert all(result["seconds"] > 0 for result in report["results"])
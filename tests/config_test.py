@@ -0,0 +1,89 @@
+import json
+import logging
+import time
+import duckdb
+from src.config import AdaptiveBatcher, DBContext
+
+root_logger = logging.getLogger()
+for handler in root_logger.handlers[:]:
+    root_logger.removeHandler(handler)
+    
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/config_test.log"),
+        logging.StreamHandler()
+    ]
+)
+
+def test_metrics(tmp_path):
+    db_path = str(tmp_path / "metrics.duckdb")
+    metrics_path = tmp_path / "metrics.jsonl"
+    for profile in (False, True):
+        with  DBContext(db_path=db_path, memory_limit=1, profile=profile, metrics_path=str(metrics_path),
+                        metrics_table="pipeline_metrics") as conn:
+            with conn.stage("test"):
+                conn.execute("CREATE OR REPLACE TABLE t AS SELECT range AS a FROM range(1000)")
+                conn.execute("UPDATE t SET a = a + 1 WHERE a < 100")
+                assert conn.execute("SELECT * FROM t WHERE a < 10 ORDER BY a") == [(a,) for a in range(1, 10)]
+            assert [m["rows"] for m in conn.metrics] == [1000, 100, 9]
+            assert all(m["stage"] == "test" and m["wall_seconds"] >= 0 and m["peak_rss_mb"] > 0 for m in conn.metrics)
+
+    records = [json.loads(line) for line in metrics_path.read_text().splitlines()]
+    assert len(records) == 6
+    stored = duckdb.connect(db_path).execute("SELECT COUNT(DISTINCT run_id), COUNT(*) FROM pipeline_metrics").fetchone()
+    assert stored == (2, 6)
+
+def test_profile_runs_statement_once(tmp_path):
+    with  DBContext(db_path=str(tmp_path / "profile.duckdb"), memory_limit=1, profile=True) as conn:
+        conn.execute("CREATE TABLE t AS SELECT range AS a FROM range(10)")
+        assert conn.execute("INSERT INTO t SELECT range FROM range(5)") == [(5,)]
+        assert conn.con.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 15
+        assert conn.execute("SELECT COUNT(*) FROM t") == [(15,)]
+        assert conn.last_profile["children"]
+        assert conn.rows_scanned("t") == 15
+
+def test_read_wide(tmp_path):
+    with  DBContext(db_path=str(tmp_path / "wide.duckdb"), memory_limit=1) as conn:
+        conn.execute("""
+            CREATE TABLE price_wide AS
+            SELECT DATE '2024-01-01' + range::INTEGER AS date, range::FLOAT AS stk_1, (range * 2)::FLOAT AS stk_2
+            FROM range(100)
+        """)
+        table = conn.read_wide("price_wide", start="2024-01-11", end="2024-01-20", symbols=[2])
+        assert table.column_names == ["date", "stk_2"]
+        assert table.column("stk_2").to_pylist() == [float(i * 2) for i in range(10, 20)]
+        arrays = conn.read_wide("price_wide", fetch="numpy")
+        assert arrays["stk_1"].sum() == sum(range(100))
+        reader = conn.read_wide("price_wide", fetch="reader", rows_per_batch=10)
+        conn.execute("SELECT 1")
+        assert sum(batch.num_rows for batch in reader) == 100
+        assert conn.metrics[-1]["rows"] == 1
+
+def test_adaptive_batches_follow_budget():
+    def batch_sizes(target_mb):
+        batches = AdaptiveBatcher(list(range(200)), initial_size=4, target_mb=target_mb)
+        for batch in batches:
+            with batches.track(batch):
+                # 2 MB per item, held long enough for the sampler to see it
+                block = b"\x01" * (len(batch) * 2 * 1024 * 1024)
+                time.sleep(0.05)
+                del block
+        return [stats["size"] for stats in batches.history]
+
+    small, large = batch_sizes(16), batch_sizes(256)
+    assert max(small) <= 8
+    assert max(large) > max(small)
+
+    # a batch that ran over the budget makes the next one smaller
+    batches = AdaptiveBatcher(list(range(200)), initial_size=20, target_mb=100)
+    batches.base_mb = 500
+    batches.resize({"size": 20, "peak_mb": 900, "rows": None})
+    assert batches.size == 5
+    batches.resize({"size": 5, "peak_mb": 600, "rows": 1000})
+    assert batches.size == 5
+    # twice the rows per item at the same cost per row halves the batch
+    batches.resize({"size": 5, "peak_mb": 600, "rows": 2000})
+    assert batches.size == 2
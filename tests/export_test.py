@@ -0,0 +1,57 @@
+import logging
+import shutil
+from pathlib import Path
+from src.config import DBContext
+from src import pipeline
+import src.export as main
+
+root_logger = logging.getLogger()
+for handler in root_logger.handlers[:]:
+    root_logger.removeHandler(handler)
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/export_test.log"),
+        logging.StreamHandler()
+    ]
+)
+
+def test_export_incremental(tmp_path):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    for path in Path("./data").glob("stock_data_*"):
+        shutil.copy(path, input_dir)
+    export_dir = tmp_path / "export"
+
+    with DBContext(db_path=str(tmp_path / "stocks.duckdb"), memory_limit=1) as conn:
+        pipeline.run(conn, str(input_dir), stages=("ingest", "transform", "returns"))
+        manifest = main.main(conn, str(export_dir), granularity="year")
+        assert set(manifest["tables"]) == {"raw", "price_wide", "trade_volume_wide", "stock_returns"}
+        for name, entry in manifest["tables"].items():
+            table = entry["table"]
+            assert entry["rows"] == conn.con.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            files = main.files_for_range(str(export_dir), table)
+            assert len(files) == len(entry["partitions"])
+            exported = conn.con.execute(f"SELECT COUNT(*) FROM read_parquet({files})").fetchone()[0]
+            assert exported == entry["rows"]
+
+        # unchanged partitions are not rewritten
+        files = {path: path.stat().st_mtime_ns for path in export_dir.rglob("*.parquet")}
+        main.main(conn, str(export_dir), granularity="year")
+        assert {path: path.stat().st_mtime_ns for path in export_dir.rglob("*.parquet")} == files
+
+        # only the partition holding the changed row is rewritten
+        first_date = conn.con.execute("SELECT MIN(date) FROM price_wide").fetchone()[0]
+        column = conn.STOCK_COLUMNS[0]
+        conn.execute(f"UPDATE price_wide SET {column} = {column} + 1 WHERE date = '{first_date}'")
+        manifest = main.main(conn, str(export_dir), tables=["price_wide"], granularity="year")
+        changed = [path for path, mtime in files.items() if path.stat().st_mtime_ns != mtime]
+        assert changed == [export_dir / manifest["tables"]["price_wide"]["partitions"][str(first_date.year)]["path"]]
+
+        # a date range resolves to the partitions overlapping it
+        files = main.files_for_range(str(export_dir), "price_wide", first_date, first_date)
+        assert len(files) == 1
+        assert conn.con.execute(f"SELECT COUNT(*) FROM read_parquet({files}) WHERE date = '{first_date}'").fetchone()[0] == 1
@@ -0,0 +1,42 @@
+import hashlib
+import logging
+import pandas as pd
+import src.generate as main
+
+root_logger = logging.getLogger()
+for handler in root_logger.handlers[:]:
+    root_logger.removeHandler(handler)
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/generate_test.log"),
+        logging.StreamHandler()
+    ]
+)
+
+def generate(output_dir, **kwargs) -> dict:
+    main.generate_stock_data_files(num_files=3, file_size_gb=0.0001, num_stocks=5, start_date="2000-01-01",
+                                   end_date="2010-12-31", output_dir=str(output_dir), engine="vectorized",
+                                   seed=42, **kwargs)
+    return {path.name: hashlib.md5(path.read_bytes()).hexdigest() for path in sorted(output_dir.glob("stock_data_*"))}
+
+def test_workers_byte_identical(tmp_path):
+    single = generate(tmp_path / "workers_1", workers=1)
+    assert len(single) == 3
+    assert generate(tmp_path / "workers_3", workers=3) == single
+    # block boundaries do not change the output either
+    assert generate(tmp_path / "block_rows", workers=1, block_rows=7) == single
+
+def test_price_continuity(tmp_path):
+    generate(tmp_path, workers=3)
+    files = [pd.read_csv(tmp_path / f"stock_data_{i}.csv") for i in (1, 2, 3)]
+    for previous, current in zip(files, files[1:]):
+        # each file starts from the prices the previous one ended on
+        last = previous[previous["date"] == previous["date"].max()].set_index("id")["price"]
+        first = current[current["date"] == current["date"].min()].set_index("id")["price"]
+        assert previous["date"].max() < current["date"].min()
+        assert len(first) == 5
+        pd.testing.assert_series_equal(first, last)
@@ -1,4 +1,7 @@
 import logging
+import os
+import shutil
+from pathlib import Path
 import src.ingest as main 
 from src.config import DBContext
 
@@ -18,4 +21,74 @@ logging.basicConfig(
     
 def test_main():
     with  DBContext(profile=True, memory_limit=0.5) as conn:
-        main.process_file_by_file(conn, input_dir='./data/') 
\ No newline at end of file
+        main.process_file_by_file(conn, input_dir='./data/') 
+def test_bulk():
+    with  DBContext(profile=True, memory_limit=0.5) as conn:
+        main.process_file_by_file(conn, input_dir='./data/', mode='bulk', close=False)
+        # Arrow inputs are unregistered once loaded instead of staying pinned to the connection
+        views = conn.con.execute("SELECT table_name FROM information_schema.tables WHERE table_name LIKE 'arrow_input%'").fetchall()
+        assert views == []
+        # the bulk load's preserve_insertion_order = false does not leak into later stages
+        assert conn.con.execute("SELECT current_setting('preserve_insertion_order')").fetchone()[0] is True
+
+def file_counts(conn) -> dict:
+    return dict(conn.con.execute("SELECT file_id, COUNT(*) FROM stocks.raw GROUP BY file_id").fetchall())
+
+def manifest_batches(conn) -> dict:
+    return dict(conn.con.execute("SELECT file_id, batch_id FROM stocks.ingest_manifest").fetchall())
+
+def test_bulk_concurrent():
+    with  DBContext(memory_limit=0.5, cpu_count=2) as conn:
+        main.process_file_by_file(conn, input_dir='./data/', mode='bulk', max_concurrency=2, close=False)
+        rows = conn.con.execute("SELECT COUNT(*) FROM stocks.raw").fetchone()[0]
+        assert rows == sum(file_counts(conn).values()) > 0
+        assert manifest_batches(conn) == {file_id: 1 for file_id in file_counts(conn)}
+
+def test_incremental(tmp_path):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    for path in Path("./data").glob("stock_data_*"):
+        shutil.copy(path, input_dir)
+
+    with  DBContext(db_path=str(tmp_path / "stocks.duckdb"), profile=True, memory_limit=0.5) as conn:
+        main.process_file_by_file(conn, input_dir=str(input_dir), incremental=True, close=False)
+        counts, batches = file_counts(conn), manifest_batches(conn)
+        assert set(batches.values()) == {1}
+
+        # nothing changed: nothing is loaded
+        main.process_file_by_file(conn, input_dir=str(input_dir), incremental=True, close=False)
+        assert file_counts(conn) == counts
+        assert manifest_batches(conn) == batches
+
+        # a changed file replaces only its own rows
+        csv_path = next(input_dir.glob("*.csv"))
+        lines = csv_path.read_text().splitlines(keepends=True)
+        csv_path.write_text("".join(lines[:-100]))
+        changed = conn.con.execute(
+            f"SELECT file_id FROM stocks.ingest_manifest WHERE path = '{csv_path.resolve().as_posix()}'").fetchone()[0]
+        main.process_file_by_file(conn, input_dir=str(input_dir), incremental=True, close=False)
+        assert file_counts(conn) == {**counts, changed: counts[changed] - 100}
+        assert manifest_batches(conn) == {**batches, changed: 2}
+
+        # only the changed file was hashed; once hashed, a touch alone is not reloaded
+        hashed = conn.con.execute("SELECT file_id FROM stocks.ingest_manifest WHERE content_hash IS NOT NULL").fetchall()
+        assert hashed == [(changed,)]
+        os.utime(csv_path)
+        main.process_file_by_file(conn, input_dir=str(input_dir), incremental=True, close=False)
+        assert manifest_batches(conn) == {**batches, changed: 2}
+
+def test_cluster():
+    with  DBContext(profile=True, memory_limit=0.5) as conn:
+        main.process_file_by_file(conn, input_dir='./data/', mode='bulk', cluster=True, close=False)
+        total = conn.con.execute("SELECT COUNT(*) FROM stocks.raw").fetchone()[0]
+        ids = ", ".join(str(id) for id in conn.SYMBOLS[:20])
+        conn.execute(f"SELECT id, date, price FROM stocks.raw WHERE id IN ({ids})")
+        # row groups outside the batch's id range are skipped
+        assert 0 < conn.rows_scanned("stocks.raw") < total
+
+def test_symbols():
+    with  DBContext(memory_limit=0.5) as conn:
+        main.process_file_by_file(conn, input_dir='./data/', mode='bulk')
+    with  DBContext(memory_limit=0.5) as conn:
+        distinct = [row[0] for row in conn.con.execute("SELECT DISTINCT id FROM stocks.raw ORDER BY id").fetchall()]
+        assert conn.SYMBOLS == distinct
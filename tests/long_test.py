@@ -0,0 +1,38 @@
+import logging
+from src.config import DBContext
+import src.long as main
+from src import ingest, returns, transform
+
+root_logger = logging.getLogger()
+for handler in root_logger.handlers[:]:
+    root_logger.removeHandler(handler)
+    
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/long_test.log"),
+        logging.StreamHandler()
+    ]
+)
+
+def test_long_matches_wide():
+    with  DBContext(profile=True, memory_limit=1) as conn:
+        result = main.compare_layouts(conn)
+        assert result['mismatched_rows'] == 0
+
+def test_wide_views_replaced_by_tables(tmp_path):
+    with  DBContext(db_path=str(tmp_path / "stocks.duckdb"), memory_limit=1) as conn:
+        ingest.process_file_by_file(conn, input_dir='./data/', mode='bulk', close=False)
+        main.main(conn, wide="view")
+        # the wide stages rebuild their tables over the views instead of failing
+        transform.main(conn, field="all", engine="pivot")
+        returns.create_table(conn)
+        returns.calculate_returns(conn)
+        main.main(conn, wide="view")
+        transform.main(conn, field="all", engine="pivot")
+        returns.calculate_returns(conn, engine="window")
+        tables = [row[0] for row in conn.con.execute("SELECT table_name FROM duckdb_tables() ORDER BY ALL").fetchall()]
+        assert {"price_wide", "trade_volume_wide", "stock_returns"} <= set(tables)
+        assert conn.con.execute("SELECT COUNT(*) FROM duckdb_views() WHERE NOT internal").fetchone()[0] == 0
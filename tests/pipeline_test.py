@@ -0,0 +1,37 @@
+import logging
+import shutil
+from pathlib import Path
+from src.config import DBContext
+import src.pipeline as main
+
+root_logger = logging.getLogger()
+for handler in root_logger.handlers[:]:
+    root_logger.removeHandler(handler)
+    
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/pipeline_test.log"),
+        logging.StreamHandler()
+    ]
+)
+
+def test_pipeline_caches_unchanged_stages(tmp_path):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    for path in Path("./data").glob("stock_data_*"):
+        shutil.copy(path, input_dir)
+
+    with  DBContext(db_path=str(tmp_path / "stocks.duckdb"), memory_limit=1) as conn:
+        first = main.run(conn, str(input_dir), metrics=["return_5d"])
+        assert [entry["status"] for entry in first] == ["ran"] * 4
+        second = main.run(conn, str(input_dir), metrics=["return_5d"])
+        assert [entry["status"] for entry in second] == ["cached"] * 4
+
+        # a new ingest batch reruns every downstream stage
+        shutil.copy(next(input_dir.glob("*.csv")), input_dir / "stock_data_copy.csv")
+        third = main.run(conn, str(input_dir), metrics=["return_5d"])
+        assert [entry["status"] for entry in third] == ["ran"] * 4
+        assert conn.verify("price_wide")["issues"] == []
@@ -0,0 +1,41 @@
+import logging
+import pyarrow as pa
+from src.config import DBContext
+from src.pool import ReadPool
+
+root_logger = logging.getLogger()
+for handler in root_logger.handlers[:]:
+    root_logger.removeHandler(handler)
+    
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("logs/pool_test.log"),
+        logging.StreamHandler()
+    ]
+)
+
+def create_wide(conn: DBContext):
+    columns = ", ".join(f"(range * {id})::FLOAT AS stk_{id}" for id in range(1, 51))
+    conn.execute(f"CREATE TABLE price_wide AS SELECT DATE '2024-01-01' + range::INTEGER AS date, {columns} FROM range(500)")
+
+def test_read_only_pool(tmp_path):
+    db_path = str(tmp_path / "pool.duckdb")
+    with  DBContext(db_path=db_path, memory_limit=1) as conn:
+        create_wide(conn)
+        expected = conn.read_wide("price_wide", start="2024-02-01")
+
+    with ReadPool(db_path, size=4, memory_limit=1) as pool:
+        parts = pool.read_wide("price_wide", chunk_size=7, start="2024-02-01")
+    assert len(parts) == 8
+    columns = [parts[0].column("date")] + [part.column(name) for part in parts for name in part.column_names[1:]]
+    assert pa.table(columns, names=expected.column_names).equals(expected)
+
+def test_cursor_pool(tmp_path):
+    with  DBContext(db_path=str(tmp_path / "pool.duckdb"), memory_limit=1) as conn:
+        create_wide(conn)
+        with ReadPool(size=3, con=conn) as pool:
+            counts = pool.map([f"SELECT COUNT(stk_{id}) FROM price_wide" for id in range(1, 51)], fetch="all")
+        assert counts == [[(500,)]] * 50
@@ -20,4 +20,31 @@ def test_returns():
     with  DBContext(profile=True, memory_limit=1) as conn:
         main.create_table(conn)
         main.calculate_returns(conn)
-        conn.verify('stock_returns')
\ No newline at end of file
+        conn.verify('stock_returns')
+def test_window_matches_batched():
+    with  DBContext(profile=True, memory_limit=1) as conn:
+        result = main.compare_engines(conn)
+        assert result["mismatched_rows"] == 0
+
+def test_incremental():
+    with  DBContext(profile=True, memory_limit=1) as conn:
+        main.calculate_returns(conn, engine="window", incremental=True)
+        conn.execute("DELETE FROM stock_returns WHERE date > (SELECT MAX(date) - INTERVAL 30 DAY FROM stock_returns)")
+        assert main.append(conn) > 0
+        main.calculate_returns(conn, engine="window", table_name="stock_returns_full")
+        assert main.mismatched_rows(conn, "stock_returns", "stock_returns_full") == 0
+        conn.execute("DROP TABLE stock_returns_full")
+
+def test_adaptive_batches():
+    with  DBContext(profile=True, memory_limit=1) as conn:
+        main.create_table(conn, table_name="stock_returns_adaptive")
+        main.calculate_returns(conn, batch_size=5, table_name="stock_returns_adaptive", adaptive=True)
+        main.calculate_returns(conn, engine="window", table_name="stock_returns_window")
+        assert main.mismatched_rows(conn, "stock_returns_adaptive", "stock_returns_window") == 0
+        conn.execute("DROP TABLE stock_returns_adaptive")
+        conn.execute("DROP TABLE stock_returns_window")
+
+def test_verify():
+    with  DBContext(memory_limit=1) as conn:
+        main.calculate_returns(conn, engine="window")
+        assert conn.verify("stock_returns")["issues"] == []
@@ -1,4 +1,7 @@
 import logging
+import shutil
+from pathlib import Path
+import src.ingest as ingest
 from src.config import DBContext
 import src.transform as main
 
@@ -21,7 +24,61 @@ def test_table_price():
         main.main(conn, field='price') 
         conn.verify(table=f"price_wide")
 
-def test_table_price():
+def test_table_trade_volume():
     with  DBContext(profile=True, memory_limit=1) as conn:
         main.main(conn, field='trade_volume') 
-        conn.verify(table=f"trade_volume_wide")
\ No newline at end of file
+        conn.verify(table=f"trade_volume_wide")
+def test_pivot_matches_batched():
+    with  DBContext(profile=True, memory_limit=1) as conn:
+        result = main.compare_engines(conn, field='price')
+        assert result['mismatched_rows'] == 0
+
+def test_table_all():
+    with  DBContext(profile=True, memory_limit=1) as conn:
+        result = main.compare_all(conn, engine='pivot')
+        assert result['mismatched_rows'] == 0
+
+def test_incremental(tmp_path):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    for path in Path("./data").glob("stock_data_*"):
+        shutil.copy(path, input_dir)
+
+    with  DBContext(db_path=str(tmp_path / "stocks.duckdb"), profile=True, memory_limit=1) as conn:
+        ingest.process_file_by_file(conn, input_dir=str(input_dir), incremental=True, close=False)
+        main.main(conn, field='all', engine='pivot', incremental=True)
+
+        # recent dates are missing and an old price is corrected by re-ingesting its file
+        for field in main.FIELDS:
+            conn.execute(f"DELETE FROM {field}_wide WHERE date > (SELECT MAX(date) - INTERVAL 30 DAY FROM {field}_wide)")
+        csv_path = next(input_dir.glob("*.csv"))
+        lines = csv_path.read_text().splitlines(keepends=True)
+        id, date, price, volume = lines[1].strip().split(",")
+        lines[1] = f"{id},{date},{float(price) + 1:.2f},{volume}\n"
+        csv_path.write_text("".join(lines))
+        ingest.process_file_by_file(conn, input_dir=str(input_dir), incremental=True, close=False)
+
+        main.main(conn, field='all', engine='pivot', incremental=True)
+        changed = conn.con.execute("SELECT COUNT(DISTINCT date), MIN(date) FROM wide_table_changes").fetchone()
+        assert changed[0] > 0 and str(changed[1]) == date
+        main.main(conn, field='all', engine='pivot', table_suffix='_full')
+        for field in main.FIELDS:
+            assert main.mismatched_rows(conn, f"{field}_wide", f"{field}_wide_full") == 0
+
+def test_adaptive_batches():
+    with  DBContext(profile=True, memory_limit=1) as conn:
+        main.main(conn, field='price', table_suffix='_adaptive', batch_size=5, adaptive=True)
+        main.main(conn, field='price', engine='pivot', table_suffix='_pivot')
+        assert main.mismatched_rows(conn, 'price_wide_adaptive', 'price_wide_pivot') == 0
+        conn.execute("DROP TABLE price_wide_adaptive")
+        conn.execute("DROP TABLE price_wide_pivot")
+
+def test_verify():
+    with  DBContext(memory_limit=1) as conn:
+        main.main(conn, field='all', engine='pivot')
+        for field in main.FIELDS:
+            assert conn.verify(table=f"{field}_wide")["issues"] == []
+        conn.execute("UPDATE price_wide SET stk_1 = -1 WHERE date = (SELECT MAX(date) FROM price_wide)")
+        report = conn.verify(table="price_wide", start="2000-01-01")
+        assert report["out_of_range_rows"] == 1
+        main.main(conn, field='price', engine='pivot')